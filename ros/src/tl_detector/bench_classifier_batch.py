@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import time
+import argparse
+
+import cv2
+
+from light_classification.tl_classifier import TLClassifier
+
+'''
+Benchmark of batched traffic light classification:
+
+    python bench_classifier_batch.py --sizes 1 2 4 8 16 32
+
+Classifies crops from `data/training_data` with `get_classifications` in
+batches of each size and reports the cost per light. The fixed cost of a
+model call is shared by the whole batch, so it falls as the batch grows.
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+default_path = os.path.join(dir_path, "..", "..", "..", "data", "training_data")
+
+
+def load_crops(path, count):
+    crops = []
+    for image_uri in sorted(glob.glob(os.path.join(path, "*", "*.png")))[:count]:
+        image = cv2.imread(image_uri)
+        crops.append(cv2.resize(image, (30, 60), interpolation=cv2.INTER_AREA))
+    return crops
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched classification benchmark')
+    parser.add_argument('--path', default=default_path, help='training image folder')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='batch sizes')
+    parser.add_argument('--lights', type=int, default=256, help='lights per batch size')
+    args = parser.parse_args()
+
+    crops = load_crops(args.path, args.lights)
+    # Without the color cascade, which would keep most crops away from the model.
+    classifier = TLClassifier(use_cascade=False)
+    # Warm up the preallocated feature rows and the model.
+    classifier.get_classifications(crops[:max(args.sizes)])
+
+    print("lights: {}".format(len(crops)))
+    base = None
+    for size in args.sizes:
+        start_time = time.time()
+        for i in range(0, len(crops), size):
+            classifier.get_classifications(crops[i:i + size])
+        per_light = (time.time() - start_time) / len(crops)
+        base = base or per_light
+        print("batch {:>3}: {:8.1f}us/light  {:5.2f}x".format(size, 1e6 * per_light, base / per_light))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+'''
+Startup cost of the traffic light model, run without ROS:
+
+    python bench_classifier_startup.py
+
+Loads the model in a fresh interpreter once per backend and reports the time
+to import and load it, the time of the first prediction and the peak RSS of
+the process:
+
+- joblib: unpickles `model/svm.p`, which imports scikit-learn.
+- npz:    `SVMPredictor` on `model/svm.npz`, which only needs NumPy.
+
+Export svm.npz first with `python tl_classifier.py --export svm.p` in `model`.
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+model_dir = os.path.join(dir_path, "..", "..", "..", "model")
+
+# Run in the child interpreter: sys.argv[1] is the backend, sys.argv[2] the model.
+CHILD = '''
+import sys, time, json, resource
+start_time = time.time()
+if sys.argv[1] == "joblib":
+    try:
+        from sklearn.externals import joblib
+    except ImportError:
+        import joblib
+    clf = joblib.load(sys.argv[2])
+else:
+    from light_classification.svm_predictor import SVMPredictor
+    clf = SVMPredictor(sys.argv[2])
+load_time = time.time() - start_time
+
+import numpy as np
+start_time = time.time()
+clf.predict_proba(np.zeros((1, 96)))
+predict_time = time.time() - start_time
+
+# ru_maxrss is in KB on Linux.
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"load_ms": 1000.0 * load_time, "first_predict_ms": 1000.0 * predict_time,
+                  "rss_mb": rss / 1024.0}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Traffic light model startup benchmark')
+    parser.add_argument('--joblib', default=os.path.join(model_dir, "svm.p"), help='pickled model')
+    parser.add_argument('--npz', default=os.path.join(model_dir, "svm.npz"), help='exported model')
+    parser.add_argument('--runs', type=int, default=3, help='fresh processes per backend')
+    args = parser.parse_args()
+
+    print("{:<8} {:>10} {:>18} {:>10}".format("backend", "load (ms)", "1st predict (ms)", "RSS (MB)"))
+    for backend, path in [("joblib", args.joblib), ("npz", args.npz)]:
+        if not os.path.isfile(path):
+            print("{:<8} missing {}".format(backend, path))
+            continue
+        results = []
+        for _ in range(args.runs):
+            output = subprocess.check_output([sys.executable, "-c", CHILD, backend, path], cwd=dir_path)
+            results.append(json.loads(output.decode().strip().splitlines()[-1]))
+        # Best of the runs, the first one may include a cold disk cache.
+        best = min(results, key=lambda r: r["load_ms"])
+        print("{:<8} {:>10.1f} {:>18.2f} {:>10.1f}".format(
+            backend, best["load_ms"], best["first_predict_ms"], best["rss_mb"]))
+
+
+if __name__ == '__main__':
+    main()
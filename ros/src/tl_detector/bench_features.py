@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from light_classification.features import NUM_FEATURES, color_hist
+
+'''
+Benchmark of the color histogram feature, run without ROS:
+
+    python bench_features.py
+
+Reports the time per crop of `features.color_hist` and of the three
+`np.histogram` calls it replaced, on the training crops and on random
+images. That both give the same counts is checked by
+`test/test_features.py`.
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+default_path = os.path.join(dir_path, "..", "..", "..", "data", "training_data")
+
+
+def legacy_color_hist(img, nbins=32, bins_range=(0, 256)):
+    """ The feature the classifier and the training script computed before.
+    """
+    channel1_hist = np.histogram(img[:, :, 0], bins=nbins, range=bins_range)
+    channel2_hist = np.histogram(img[:, :, 1], bins=nbins, range=bins_range)
+    channel3_hist = np.histogram(img[:, :, 2], bins=nbins, range=bins_range)
+    return np.concatenate((channel1_hist[0], channel2_hist[0], channel3_hist[0]))
+
+
+def bench_images(path):
+    images = [cv2.imread(uri) for uri in sorted(glob.glob(os.path.join(path, "*", "*.png")))]
+
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        h, w = rng.randint(1, 80, 2)
+        images.append(rng.randint(0, 256, (h, w, 3)).astype(np.uint8))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Color histogram benchmark')
+    parser.add_argument('--path', default=default_path, help='training image folder')
+    parser.add_argument('--repeat', type=int, default=5, help='timing passes over the crops')
+    args = parser.parse_args()
+
+    images = bench_images(args.path)
+    out = np.empty(NUM_FEATURES)
+    crops = [cv2.resize(image, (30, 60), interpolation=cv2.INTER_AREA) for image in images]
+    print("crops: {}".format(len(crops)))
+    for name, fn in [("np.histogram x3", legacy_color_hist),
+                     ("bincount", lambda img: color_hist(img, out))]:
+        start_time = time.time()
+        for _ in range(args.repeat):
+            for crop in crops:
+                fn(crop)
+        elapsed = (time.time() - start_time) / (args.repeat * len(crops))
+        print("{:<16} {:8.2f}us/crop".format(name, 1e6 * elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from light_classification.features import NUM_FEATURES, IntegralHistogram, color_hist, sliding_windows
+
+'''
+Equivalence check and benchmark of the integral histogram, run without ROS:
+
+    python bench_integral_histogram.py [--height 600 --width 800 --stride 4]
+
+Builds the windows of a dense multi-scale search over a random frame and
+computes the histogram of each one with repeated `color_hist` calls and with
+one `IntegralHistogram` of the frame. Exits with status 1 if any window
+differs, then reports the time per frame of both, and the build time and
+memory of the integral histogram. The default is a full camera frame; pass
+a smaller --height to see the cost of searching only a band of rows.
+'''
+
+SIZES = [(60, 30), (90, 45), (120, 60)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integral histogram equivalence check and benchmark')
+    parser.add_argument('--height', type=int, default=600, help='searched frame height')
+    parser.add_argument('--width', type=int, default=800, help='searched frame width')
+    parser.add_argument('--stride', type=int, default=4, help='step between windows')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, (args.height, args.width, 3)).astype(np.uint8)
+    windows = sliding_windows(args.height, args.width, SIZES, args.stride)
+
+    start_time = time.time()
+    expected = np.array([color_hist(frame[t:b, l:r]) for t, l, b, r in windows]).reshape(-1, NUM_FEATURES)
+    hist_time = time.time() - start_time
+
+    start_time = time.time()
+    integral = IntegralHistogram(frame)
+    build_time = time.time() - start_time
+    start_time = time.time()
+    features = integral.features_batch(windows)
+    lookup_time = time.time() - start_time
+
+    mismatches = int(np.sum(np.any(features != expected, axis=1)))
+    single = [integral.features(*window) for window in windows[::97]]
+    mismatches += int(np.sum(np.any(np.array(single).reshape(-1, NUM_FEATURES) != expected[::97], axis=1)))
+    print("frame: {}x{}, windows: {}, mismatches: {}".format(
+        args.height, args.width, len(windows), mismatches))
+    if mismatches:
+        sys.exit(1)
+
+    integral_time = build_time + lookup_time
+    print("color_hist per window  {:8.1f}ms/frame".format(1e3 * hist_time))
+    print("integral histogram     {:8.1f}ms/frame (build {:.1f}ms, lookups {:.1f}ms)".format(
+        1e3 * integral_time, 1e3 * build_time, 1e3 * lookup_time))
+    print("speedup                {:8.1f}x".format(hist_time / integral_time))
+    print("integral build         {:8.1f}ms, planes {:.1f}MB".format(
+        1e3 * build_time, integral.planes.nbytes / 1e6))
+
+
+if __name__ == '__main__':
+    main()
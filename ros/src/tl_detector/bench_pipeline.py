@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import resource
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from styx_msgs.msg import TrafficLight
+from light_classification.tl_classifier import TLClassifier
+from image_roi import decode_roi, resize_image
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(dir_path, "..", "waypoint_updater"))
+from timing import Timings
+
+'''
+Offline benchmark of the traffic light pipeline, without roscore or the
+simulator:
+
+    python bench_pipeline.py [--path FOLDER] [--repeat 3] [--json report.json]
+                             [--max-p99-ms 5] [--min-fps 500] [--min-accuracy 0.9]
+                             [--max-memory-mb 200]
+
+Every image in the subfolders of FOLDER (default `data/training_data`) goes
+through the stages the node runs on a light:
+
+    crop      `decode_roi` of the light's box out of a bgr8 image message
+    resize    `resize_image` to the 30x60 classifier input
+    classify  `TLClassifier.get_classification` (color cascade, then SVM)
+
+The SVM path of `get_classification` is also timed on its own, as the
+`features` (`extract_features_from_image`) and `predict` stages. The subfolder
+name gives the expected state (red*, yellow*, green*, no*); images of other
+folders are timed but not scored.
+
+Reports p50/p99 per stage, lights per second through crop, resize and
+classify, peak memory and accuracy. With thresholds given, exits with status 1
+if any is not met, so CI can catch performance regressions.
+'''
+
+default_path = os.path.join(dir_path, "..", "..", "..", "data", "training_data")
+
+# Expected state of the lights of a folder, by the start of its name.
+FOLDER_STATES = [("red", TrafficLight.RED), ("yellow", TrafficLight.YELLOW),
+                 ("green", TrafficLight.GREEN), ("no", TrafficLight.UNKNOWN)]
+
+STAGES = ["crop", "resize", "classify", "features", "predict"]
+PIPELINE = ["crop", "resize", "classify"]
+
+# Fields of sensor_msgs/Image that `decode_roi` reads.
+ImageMsg = namedtuple('ImageMsg', 'height width step encoding data')
+
+
+def folder_state(folder):
+    """
+    Returns:
+        int: Expected TrafficLight state of the images of a folder, None if
+             the name does not tell.
+    """
+    name = os.path.basename(folder).lower()
+    for prefix, state in FOLDER_STATES:
+        if name.startswith(prefix):
+            return state
+    return None
+
+
+def list_images(path, limit=None):
+    """ List the images of the subfolders of `path`.
+
+    Returns:
+        list: (file path, expected state or None) of each image.
+    """
+    images = []
+    for folder in sorted(glob.glob(os.path.join(path, "*"))):
+        if not os.path.isdir(folder):
+            continue
+        state = folder_state(folder)
+        images.extend((uri, state) for uri in sorted(glob.glob(os.path.join(folder, "*"))))
+    return images[:limit]
+
+
+def read_image(uri):
+    """ Read an image file as a bgr8 image message, None if it is not an image.
+    """
+    image = cv2.imread(uri)
+    if image is None:
+        return None
+    return ImageMsg(image.shape[0], image.shape[1], image.shape[1] * 3, 'bgr8', image.tobytes())
+
+
+def run(classifier, images, repeat):
+    """ Time every stage on every image `repeat` times.
+
+    Images are read one at a time, like frames arriving at the node, so the
+    memory used does not grow with the number of images.
+
+    Returns:
+        Timings: Samples of each stage.
+        ndarray: State returned by `get_classification` on the first pass,
+                 -1 for files that are not images.
+        ndarray: State predicted by the SVM alone on the first pass.
+    """
+    timings = Timings(size=max(len(images) * repeat, 1))
+    states = np.full(len(images), -1, dtype=int)
+    svm_states = np.full(len(images), -1, dtype=int)
+    for n in range(repeat):
+        for i, (uri, _) in enumerate(images):
+            msg = read_image(uri)
+            if msg is None:
+                continue
+            with timings.timer('crop'):
+                crop = decode_roi(msg, 0, 0, msg.height, msg.width)
+            with timings.timer('resize'):
+                crop = resize_image(crop, 30, 60)
+            with timings.timer('classify'):
+                state = classifier.get_classification(crop)
+            with timings.timer('features'):
+                x = classifier.extract_features_from_image(crop)
+            with timings.timer('predict'):
+                prediction = classifier.clf.predict([x])[0]
+            if n == 0:
+                states[i] = state
+                svm_states[i] = classifier.to_light_state(prediction)
+    return timings, states, svm_states
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline traffic light pipeline benchmark')
+    parser.add_argument('--path', default=default_path, help='folder of labelled image folders')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes over the images')
+    parser.add_argument('--limit', type=int, default=None, help='use only the first images')
+    parser.add_argument('--no-cascade', action='store_true', help='classify without the color cascade')
+    parser.add_argument('--json', default=None, help='write the report to this file')
+    parser.add_argument('--max-p99-ms', type=float, default=None,
+                        help='fail if the p99 of crop + resize + classify is above')
+    parser.add_argument('--min-fps', type=float, default=None, help='fail if fewer lights per second')
+    parser.add_argument('--min-accuracy', type=float, default=None, help='fail if less accurate')
+    parser.add_argument('--max-memory-mb', type=float, default=None, help='fail if the peak memory is above')
+    args = parser.parse_args()
+
+    images = list_images(args.path, args.limit)
+    if not images:
+        print("no images in {}".format(args.path))
+        sys.exit(1)
+    classifier = TLClassifier(use_cascade=not args.no_cascade)
+    # Warm up the model before timing.
+    run(classifier, images[:8], 1)
+    timings, states, svm_states = run(classifier, images, args.repeat)
+
+    summaries = timings.summaries()
+    timed = timings.timer('crop').count
+    if timed == 0:
+        print("no readable images in {}".format(args.path))
+        sys.exit(1)
+    pipeline = np.sum([timings.timer(name).samples[:timed] for name in PIPELINE], axis=0)
+    expected = np.array([-1 if state is None else state for _, state in images])
+    labelled = (expected >= 0) & (states >= 0)
+    report = {
+        "images": len(images),
+        "labelled": int(labelled.sum()),
+        "stages": dict((name, summaries[name]) for name in STAGES),
+        "pipeline_p50_ms": 1000.0 * float(np.percentile(pipeline, 50)),
+        "pipeline_p99_ms": 1000.0 * float(np.percentile(pipeline, 99)),
+        "fps": len(pipeline) / float(np.sum(pipeline)),
+        "peak_memory_mb": peak_memory_mb(),
+        "accuracy": float(np.mean(states[labelled] == expected[labelled])) if labelled.any() else None,
+        "svm_accuracy": float(np.mean(svm_states[labelled] == expected[labelled])) if labelled.any() else None,
+    }
+
+    print("images: {} ({} labelled), passes: {}".format(report["images"], report["labelled"], args.repeat))
+    for name in STAGES:
+        summary = report["stages"][name]
+        print("{:<10} p50 {:8.3f}ms  p99 {:8.3f}ms".format(name, summary["p50_ms"], summary["p99_ms"]))
+    print("{:<10} p50 {:8.3f}ms  p99 {:8.3f}ms  {:.0f} lights/s".format(
+        "pipeline", report["pipeline_p50_ms"], report["pipeline_p99_ms"], report["fps"]))
+    print("peak memory: {:.1f}MB".format(report["peak_memory_mb"]))
+    if report["accuracy"] is not None:
+        print("accuracy: {:.1%} (SVM alone {:.1%})".format(report["accuracy"], report["svm_accuracy"]))
+
+    failures = []
+    if args.max_p99_ms is not None and report["pipeline_p99_ms"] > args.max_p99_ms:
+        failures.append("p99 {:.3f}ms > {}ms".format(report["pipeline_p99_ms"], args.max_p99_ms))
+    if args.min_fps is not None and report["fps"] < args.min_fps:
+        failures.append("{:.0f} lights/s < {}".format(report["fps"], args.min_fps))
+    if args.min_accuracy is not None and (report["accuracy"] or 0.0) < args.min_accuracy:
+        failures.append("accuracy {} < {}".format(report["accuracy"], args.min_accuracy))
+    if args.max_memory_mb is not None and report["peak_memory_mb"] > args.max_memory_mb:
+        failures.append("peak memory {:.1f}MB > {}MB".format(report["peak_memory_mb"], args.max_memory_mb))
+    report["failures"] = failures
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print("FAIL: " + failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import math
+import bisect
+import threading
+
+import numpy as np
+
+'''
+Camera projection for tl_detector, without tf lookups.
+
+`PoseHistory` keeps the last car poses by stamp, so the pose at the time an
+image was taken is an interpolation between two cached poses instead of a
+blocking `waitForTransform`. `CameraModel` builds one 3x4 projection matrix
+from that pose and the camera intrinsics and projects every candidate light
+with a single matrix product.
+'''
+
+# Size (m) of a traffic light housing.
+LIGHT_WIDTH = 1.0
+LIGHT_HEIGHT = 1.95
+
+
+def yaw_from_quaternion(q):
+    """ Heading (rad) of a geometry_msgs/Quaternion.
+    """
+    return math.atan2(2.0 * (q.w * q.z + q.x * q.y), 1.0 - 2.0 * (q.y * q.y + q.z * q.z))
+
+
+class PoseHistory(object):
+    def __init__(self, size=100):
+        """
+        Args:
+            size (int): Number of poses to keep.
+        """
+        self.size = size
+        self.lock = threading.Lock()
+        self.times = []
+        self.poses = []
+
+    def add(self, stamp, pose):
+        """ Add the car pose at `stamp`. Poses older than the last one are ignored.
+
+        Args:
+            stamp (Time): Stamp of the pose.
+            pose (Pose): Car pose.
+        """
+        t = stamp.to_sec()
+        p = pose.position
+        entry = (p.x, p.y, p.z, yaw_from_quaternion(pose.orientation))
+        with self.lock:
+            if self.times and t < self.times[-1]:
+                return
+            self.times.append(t)
+            self.poses.append(entry)
+            if len(self.times) > 2 * self.size:
+                del self.times[:self.size]
+                del self.poses[:self.size]
+
+    def lookup(self, stamp):
+        """ Get the car pose at `stamp`, never blocks.
+
+        Returns:
+            tuple: (x, y, z, yaw) interpolated between the cached poses around
+                   `stamp`, or the oldest/newest one outside of them. None if
+                   no pose was added yet.
+        """
+        t = stamp.to_sec()
+        with self.lock:
+            if not self.times:
+                return None
+            i = bisect.bisect_left(self.times, t)
+            if i == 0:
+                return self.poses[0]
+            if i == len(self.times):
+                return self.poses[-1]
+            t0, t1 = self.times[i - 1], self.times[i]
+            p0, p1 = self.poses[i - 1], self.poses[i]
+
+        r = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+        dyaw = math.atan2(math.sin(p1[3] - p0[3]), math.cos(p1[3] - p0[3]))
+        return (p0[0] + r * (p1[0] - p0[0]),
+                p0[1] + r * (p1[1] - p0[1]),
+                p0[2] + r * (p1[2] - p0[2]),
+                p0[3] + r * dyaw)
+
+
+class CameraModel(object):
+    def __init__(self, fx, fy, cx, cy, width, height, mount_height=1.0):
+        """
+        Args:
+            fx, fy (double): Focal lengths in pixels.
+            cx, cy (double): Optical center in pixels.
+            width, height (int): Image size in pixels.
+            mount_height (double): Height (m) of the camera above the car's pose.
+        """
+        self.fx = fx
+        self.fy = fy
+        self.cx = cx
+        self.cy = cy
+        self.width = width
+        self.height = height
+        self.mount_height = mount_height
+
+    @classmethod
+    def from_config(cls, camera_info):
+        """ Build the model from the `camera_info` block of the traffic light config.
+
+        The optical center defaults to the image center and the camera
+        height to 1 m.
+        """
+        width = camera_info['image_width']
+        height = camera_info['image_height']
+        return cls(camera_info['focal_length_x'], camera_info['focal_length_y'],
+                   camera_info.get('optical_center_x', width / 2.0),
+                   camera_info.get('optical_center_y', height / 2.0),
+                   width, height, camera_info.get('camera_height', 1.0))
+
+    def set_camera_info(self, msg):
+        """ Take the intrinsics from a sensor_msgs/CameraInfo.
+        """
+        self.fx, self.cx, self.fy, self.cy = msg.K[0], msg.K[2], msg.K[4], msg.K[5]
+        if msg.width and msg.height:
+            self.width = msg.width
+            self.height = msg.height
+
+    def projection_matrix(self, car):
+        """ 3x4 matrix from homogeneous world coordinates to image coordinates.
+
+        Args:
+            car (tuple): (x, y, z, yaw) pose of the car.
+        """
+        x, y, z, yaw = car
+        c = math.cos(yaw)
+        s = math.sin(yaw)
+        # World to car frame (x ahead, y left, z up).
+        world_to_car = np.array([[c, s, 0.0, -c * x - s * y],
+                                 [-s, c, 0.0, s * x - c * y],
+                                 [0.0, 0.0, 1.0, -z],
+                                 [0.0, 0.0, 0.0, 1.0]])
+        # Car frame to camera axes (right, down, forward).
+        car_to_camera = np.array([[0.0, -1.0, 0.0, 0.0],
+                                  [0.0, 0.0, -1.0, self.mount_height],
+                                  [1.0, 0.0, 0.0, 0.0]])
+        intrinsics = np.array([[self.fx, 0.0, self.cx],
+                               [0.0, self.fy, self.cy],
+                               [0.0, 0.0, 1.0]])
+        return intrinsics.dot(car_to_camera).dot(world_to_car)
+
+    def light_boxes(self, car, points):
+        """ Bounding boxes of traffic lights in the image.
+
+        Args:
+            car (tuple): (x, y, z, yaw) pose of the car.
+            points (array-like): (M, 3) world positions of the lights.
+
+        Returns:
+            (ndarray, ndarray): (M, 4) int boxes as (top, left, bottom, right)
+                                and whether each box overlaps the image.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        uvw = np.hstack((points, np.ones((len(points), 1)))).dot(
+            self.projection_matrix(car).T)
+        ahead = uvw[:, 2] > 0.0
+        depth = np.where(ahead, uvw[:, 2], 1.0)
+        u = uvw[:, 0] / depth
+        v = uvw[:, 1] / depth
+
+        # Size of traffic light within 2D picture
+        distance = np.maximum(np.hypot(points[:, 0] - car[0], points[:, 1] - car[1]), 1e-3)
+        half_w = self.fx * np.arctan(LIGHT_WIDTH / (2.0 * distance))
+        half_h = self.fx * np.arctan(LIGHT_HEIGHT / (2.0 * distance))
+
+        boxes = np.column_stack((v - half_h, u - half_w, v + half_h, u + half_w)).astype(int)
+        boxes[~ahead] = 0
+        visible = (ahead & (boxes[:, 2] > 0) & (boxes[:, 0] < self.height) &
+                   (boxes[:, 3] > 0) & (boxes[:, 1] < self.width))
+        return boxes, visible
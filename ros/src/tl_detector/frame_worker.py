@@ -0,0 +1,84 @@
+import sys
+import threading
+import traceback
+
+'''
+Single-slot, latest-frame-wins background worker.
+
+The subscriber thread only drops the newest frame into the slot. The worker
+thread always processes the most recent frame; a frame that is replaced
+before the worker gets to it is dropped, so processing never falls behind
+the camera. An exception raised while processing a frame is reported and
+the worker goes on with the next frame.
+'''
+
+
+class LatestFrameWorker(object):
+    def __init__(self, process_fn, error_fn=None):
+        """
+        Args:
+            process_fn (callable): Called in the worker thread with each frame.
+            error_fn (callable): Called with the formatted traceback when
+                                 `process_fn` raises, None to print it to stderr.
+        """
+        self.process_fn = process_fn
+        self.error_fn = error_fn
+        self.cond = threading.Condition()
+        self.slot = None
+        self.running = True
+
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, frame):
+        """ Hand a frame to the worker, replacing any frame still waiting.
+        """
+        with self.cond:
+            if self.slot is not None:
+                self.dropped += 1
+            self.slot = frame
+            self.received += 1
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.slot is None and self.running:
+                    self.cond.wait(1.0)
+                if not self.running:
+                    return
+                frame = self.slot
+                self.slot = None
+            try:
+                self.process_fn(frame)
+            except Exception:
+                self.errors += 1
+                self.report_error(traceback.format_exc())
+            self.processed += 1
+
+    def report_error(self, message):
+        if self.error_fn is None:
+            sys.stderr.write(message)
+        else:
+            self.error_fn(message)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "drop_rate": self.dropped / float(max(self.received, 1))
+        }
@@ -0,0 +1,79 @@
+import math
+
+import cv2
+import numpy as np
+
+'''
+Decoding of a region of interest straight from a sensor_msgs/Image buffer.
+
+Only the rows of the ROI are viewed (no copy of the full frame is made),
+and only the ROI itself is copied out, converted to the BGR channel order
+the classifier is trained on, and resized to the classifier's input size.
+'''
+
+CHANNELS = {
+    'rgb8': 3,
+    'bgr8': 3,
+    'rgba8': 4,
+    'bgra8': 4,
+}
+
+
+def decode_roi(msg, top, left, bottom, right):
+    """ Get the pixels of an image message inside a bounding box.
+
+    The box is clipped to the image.
+
+    Args:
+        msg (Image): 8-bit color image message.
+        top, left, bottom, right (int): Bounding box, bottom/right exclusive.
+
+    Returns:
+        ndarray: (rows, cols, 3) uint8 BGR image, possibly empty.
+    """
+    channels = CHANNELS[msg.encoding]
+    top, bottom = max(top, 0), min(bottom, msg.height)
+    left, right = max(left, 0), min(right, msg.width)
+    if bottom <= top or right <= left:
+        return np.zeros((0, 0, 3), dtype=np.uint8)
+
+    rows = np.frombuffer(msg.data, dtype=np.uint8, count=(bottom - top) * msg.step,
+                         offset=top * msg.step).reshape(bottom - top, msg.step)
+    roi = rows[:, left * channels:right * channels].reshape(bottom - top, right - left, channels)
+    if msg.encoding.startswith('rgb'):
+        roi = roi[:, :, 2::-1]
+    else:
+        roi = roi[:, :, :3]
+    return np.ascontiguousarray(roi)
+
+
+
+def resize_image(img, width, height):
+    """ Resize a light crop to the classifier's input size.
+
+    The crop is first trimmed to a 1:2 aspect ratio around its center, so
+    the light is not stretched.
+
+    Args:
+        img (ndarray): Crop of the light.
+        width, height (int): Size of the resized crop.
+
+    Returns:
+        ndarray: (height, width, 3) resized crop.
+    """
+    aspect_ratio_width = 0.5
+    aspect_ratio_height = height/width
+    img_height, img_width = img.shape[:2]
+    crop_height = int(img_width / aspect_ratio_width)
+    extra_height = (img_height - crop_height) / 2
+    crop_width = int(img_height / aspect_ratio_height)
+    extra_width = (img_width - crop_width) / 2
+    # Crop image to keep aspect ratio
+    if extra_height > 0:
+        crop_img = img[int(extra_height):int(img_height-math.ceil(extra_height)), 0:int(img_width)]
+    elif extra_width > 0:
+        crop_img = img[0:int(img_height), int(extra_width):int(img_width-math.ceil(extra_width))]
+    else:
+        crop_img = img
+
+    return cv2.resize(crop_img, (width, height), 0, 0, interpolation=cv2.INTER_AREA)
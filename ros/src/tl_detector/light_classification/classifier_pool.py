@@ -0,0 +1,269 @@
+import sys
+import time
+import threading
+import traceback
+import multiprocessing
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+from collections import deque
+
+import numpy as np
+
+from light_classification.tl_classifier import TLClassifier
+
+'''
+Pool of classifier processes fed through a shared-memory ROI ring.
+
+Feature extraction and the SVM hold the GIL, so classifying in threads does
+not use more than one core. Here every worker process loads its own
+`TLClassifier` and reads the resized light ROIs from a ring of fixed-size
+slots in shared memory; only (sequence number, part, slot, shape) tuples go
+through the task queue and class probabilities come back.
+
+A frame is submitted with the ROIs of all its visible lights under one
+sequence number, each ROI a part of it that any worker can take. Workers
+finish out of order, so results are held in a reorder buffer until all
+parts of a frame are back, and frames are handed out by increasing sequence
+number, i.e. in the order they were submitted. A ROI that fails to classify
+comes back with None probabilities. A frame with a ROI lost with a dead
+worker is given up after `task_timeout`, so it cannot hold back the frames
+after it. A killed worker can leave the queues locked, so then the queues
+and all workers are replaced.
+'''
+
+# Shape of a resized light ROI, see `TLDetector.resize_image`.
+ROI_SHAPE = (60, 30, 3)
+
+
+def classify_slots(ring, num_slots, tasks, results, use_cascade, model_path):
+    """ Worker process loop.
+
+    Args:
+        ring (RawArray): Shared ROI slots.
+        num_slots (int): Number of slots in the ring.
+        tasks (Queue): (seq, part, slot, rows, cols) tuples, None to exit.
+        results (Queue): (seq, part, slot, probabilities, seconds) tuples,
+                         None probabilities if the ROI could not be
+                         classified.
+        use_cascade (bool): See `TLClassifier`.
+        model_path (str): See `TLClassifier`.
+    """
+    classifier = TLClassifier(use_cascade, model_path)
+    frames = np.frombuffer(ring, dtype=np.uint8).reshape((num_slots,) + ROI_SHAPE)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, part, slot, rows, cols = task
+        start_time = time.time()
+        try:
+            probabilities = classifier.get_probabilities(frames[slot, :rows, :cols])
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            probabilities = None
+        results.put((seq, part, slot, probabilities, time.time() - start_time))
+
+
+class InFlight(object):
+    """ A submitted frame whose ROIs are not all back yet.
+    """
+    def __init__(self, meta, size):
+        self.meta = meta
+        self.start_time = time.time()
+        # Slot of every part in the workers, None once it is back.
+        self.slots = [None] * size
+        self.probabilities = [None] * size
+        self.remaining = 0
+        self.elapsed = 0.0
+
+    def add(self, part, slot):
+        self.slots[part] = slot
+        self.remaining += 1
+
+    def finish(self, part, probabilities, elapsed):
+        self.slots[part] = None
+        self.probabilities[part] = probabilities
+        self.remaining -= 1
+        self.elapsed += elapsed
+
+
+class ClassifierPool(object):
+    def __init__(self, workers, slots=None, use_cascade=True, model_path=None, task_timeout=1.0):
+        """
+        Args:
+            workers (int): Number of worker processes.
+            slots (int): Number of ROI slots, i.e. frames in flight. Defaults to
+                         four per worker.
+            use_cascade (bool): Whether the workers run the color cascade.
+            model_path (str): Model the workers load, see `TLClassifier`.
+            task_timeout (double): Seconds after which a frame whose ROIs have
+                                   not all come back is handed out, with None
+                                   probabilities for the missing ones.
+        """
+        self.use_cascade = use_cascade
+        self.model_path = model_path
+        self.task_timeout = task_timeout
+        self.num_slots = slots or 4 * workers
+        self.ring = multiprocessing.RawArray('B', self.num_slots * int(np.prod(ROI_SHAPE)))
+        self.frames = np.frombuffer(self.ring, dtype=np.uint8).reshape(
+            (self.num_slots,) + ROI_SHAPE)
+        self.free = deque(range(self.num_slots))
+
+        self.num_workers = workers
+        self.start_workers()
+
+        self.lock = threading.Lock()
+        # seq -> (meta, probabilities, seconds) of finished frames not handed out yet.
+        self.pending = {}
+        # seq -> InFlight of the frames in the workers.
+        self.in_flight = {}
+        # seq -> parts still in the workers of given up frames, whose late
+        # results are ignored.
+        self.lost = {}
+        self.next_seq = 0
+        self.next_out = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.timed_out = 0
+        self.restarted = 0
+        self.closed = False
+
+    def start_workers(self):
+        """ Start the workers on new queues. Results still in the old queues
+        are lost; their frames time out.
+        """
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        for _ in range(self.num_workers):
+            worker = multiprocessing.Process(target=classify_slots,
+                                             args=(self.ring, self.num_slots,
+                                                   self.tasks, self.results, self.use_cascade,
+                                                   self.model_path))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, rois, meta):
+        """ Queue the ROIs of a frame for classification.
+
+        Args:
+            rois (list): Resized light ROIs, each at most ROI_SHAPE. None for
+                         a light that needs no classification; it is handed
+                         out with None probabilities. A frame with nothing
+                         to classify is still handed out in order.
+            meta: Passed back with the result.
+
+        Returns:
+            bool: False if there are not enough free slots and the frame was
+                  dropped.
+        """
+        parts = [(part, roi) for part, roi in enumerate(rois) if roi is not None]
+        for _, roi in parts:
+            if roi.shape[0] > ROI_SHAPE[0] or roi.shape[1] > ROI_SHAPE[1]:
+                raise ValueError("ROI {} does not fit a {} slot".format(roi.shape, ROI_SHAPE))
+        with self.lock:
+            if len(parts) > len(self.free):
+                self.dropped += 1
+                return False
+            seq = self.next_seq
+            self.next_seq += 1
+            self.submitted += 1
+            frame = InFlight(meta, len(rois))
+            self.in_flight[seq] = frame
+            if not parts:
+                # Goes through the result queue to keep its place in the order.
+                self.results.put((seq, None, None, None, 0.0))
+                return True
+            for part, roi in parts:
+                slot = self.free.popleft()
+                frame.add(part, slot)
+                rows, cols = roi.shape[:2]
+                self.frames[slot, :rows, :cols] = roi
+                self.tasks.put((seq, part, slot, rows, cols))
+        return True
+
+    def get_results(self, timeout=None):
+        """ Wait for classified frames.
+
+        Args:
+            timeout (double): Seconds to wait for a worker, None to block.
+
+        Returns:
+            list: (meta, probabilities, seconds) of every frame that is
+                  ready, in submission order. probabilities has an entry,
+                  possibly None, for each submitted ROI; seconds is the time
+                  the workers spent classifying them. Empty on timeout.
+        """
+        done = []
+        try:
+            done.append(self.results.get(timeout=timeout))
+            while True:
+                done.append(self.results.get_nowait())
+        except Empty:
+            pass
+
+        ready = []
+        with self.lock:
+            for seq, part, slot, probabilities, elapsed in done:
+                if seq in self.lost:
+                    # Its slots were released when it was given up.
+                    self.lost[seq] -= 1
+                    if self.lost[seq] <= 0:
+                        del self.lost[seq]
+                    continue
+                frame = self.in_flight[seq]
+                if part is not None:
+                    self.free.append(slot)
+                    frame.finish(part, probabilities, elapsed)
+                if frame.remaining == 0:
+                    del self.in_flight[seq]
+                    self.pending[seq] = (frame.meta, frame.probabilities, frame.elapsed)
+                    self.completed += 1
+            now = time.time()
+            while True:
+                if self.next_out in self.pending:
+                    ready.append(self.pending.pop(self.next_out))
+                elif self.next_out in self.in_flight and \
+                        now - self.in_flight[self.next_out].start_time > self.task_timeout:
+                    # Lost with a dead worker, or stuck: give it up.
+                    frame = self.in_flight.pop(self.next_out)
+                    self.free.extend(slot for slot in frame.slots if slot is not None)
+                    self.lost[self.next_out] = frame.remaining
+                    self.timed_out += 1
+                    ready.append((frame.meta, frame.probabilities, frame.elapsed))
+                else:
+                    break
+                self.next_out += 1
+
+            # A worker died (killed, out of memory): start over.
+            if not self.closed and not all(worker.is_alive() for worker in self.workers):
+                for worker in self.workers:
+                    worker.terminate()
+                self.start_workers()
+                # Nothing more comes back from the old queues.
+                self.lost.clear()
+                self.restarted += 1
+        return ready
+
+    def close(self):
+        self.closed = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(1.0)
+
+    def stats(self):
+        return {
+            "workers": self.num_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "timed_out": self.timed_out,
+            "restarted": self.restarted,
+            "in_flight": len(self.in_flight)
+        }
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+
+from styx_msgs.msg import TrafficLight
+
+'''
+Color-threshold first stage of the traffic light classifier.
+
+A lit lamp is a blob of saturated, bright pixels of one hue. The crop is
+converted to HSV once and the pixels falling in the red, yellow and green hue
+bands are counted. If one color covers at least `min_area` pixels and at
+least `dominance` times the area of the other two together, that color is the
+answer and the SVM is not run. Anything else (no lamp, several colors,
+washed-out crops) is left to the SVM.
+'''
+
+# Only saturated, bright pixels can belong to a lit lamp.
+MIN_SATURATION = 100
+MIN_VALUE = 150
+
+# OpenCV hue (0-180) bands of the lamp colors. Red wraps around 0.
+HUE_BANDS = [
+    (TrafficLight.RED, [(0, 10), (160, 180)]),
+    (TrafficLight.YELLOW, [(18, 35)]),
+    (TrafficLight.GREEN, [(45, 95)]),
+]
+
+
+def color_areas(image):
+    """ Count the lamp-colored pixels of a BGR image.
+
+    Returns:
+        ndarray: Number of red, yellow and green pixels (HUE_BANDS order).
+    """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lit = (hsv[:, :, 1] >= MIN_SATURATION) & (hsv[:, :, 2] >= MIN_VALUE)
+    # Hue histogram of the lit pixels, then the area of each band.
+    hue_counts = np.bincount(hsv[:, :, 0][lit], minlength=181)
+    return np.array([sum(hue_counts[lo:hi + 1].sum() for lo, hi in bands)
+                     for _, bands in HUE_BANDS])
+
+
+class ColorCascade(object):
+    def __init__(self, min_area=30, dominance=4.0):
+        """
+        Args:
+            min_area (int): Pixels of one color needed to decide, out of the
+                            1800 pixels of a resized crop.
+            dominance (double): Needed ratio of that area to the area of the
+                                other colors together.
+        """
+        self.min_area = min_area
+        self.dominance = dominance
+
+        self.crops = 0
+        self.decided = 0
+
+    def decide(self, image):
+        """ Classify the crop if its color is unambiguous.
+
+        Args:
+            image (cv::Mat): BGR image containing the traffic light
+
+        Returns:
+            int: ID of traffic light color (specified in styx_msgs/TrafficLight),
+                 None if the crop needs the SVM.
+        """
+        self.crops += 1
+        if image.size == 0:
+            return None
+        areas = color_areas(image)
+        best = int(np.argmax(areas))
+        others = areas.sum() - areas[best]
+        if areas[best] >= self.min_area and areas[best] >= self.dominance * others:
+            self.decided += 1
+            return HUE_BANDS[best][0]
+        return None
+
+    def stats(self):
+        return {
+            "crops": self.crops,
+            "decided": self.decided,
+            "skip_rate": self.decided / float(max(self.crops, 1))
+        }
@@ -0,0 +1,164 @@
+import numpy as np
+
+'''
+Traffic light features, shared by the classifier node and the training script
+(`model/tl_classifier.py`) so both compute exactly the same vector.
+
+The feature is a 32 bin histogram of each color channel. With 32 bins over
+[0, 256) the bin of a uint8 value is `value >> 3`, so the three histograms
+are one `np.bincount` over `(value >> 3) + 32 * channel`. This gives the same
+counts as three `np.histogram` calls in a single pass over the pixels.
+
+For sliding-window search `IntegralHistogram` precomputes cumulative counts
+over an image once, after which the histogram of any window is four lookups
+instead of a pass over its pixels.
+'''
+
+NUM_BINS = 32
+NUM_FEATURES = 3 * NUM_BINS
+
+# Offset of each channel's bins in the feature vector.
+CHANNEL_OFFSETS = np.arange(3, dtype=np.uint8) * NUM_BINS
+
+# Pixels of a resized light crop (30x60), the area the classifier is trained on.
+CROP_PIXELS = 30 * 60
+
+
+def color_hist(img, out=None):
+    """ Computes the 32 bin histogram of each channel of an image.
+
+    Args:
+        img (ndarray): (H, W, 3) image.
+        out (ndarray): Buffer of NUM_FEATURES elements to write to, or None.
+
+    Returns:
+        ndarray: The histograms of channels 0, 1 and 2 concatenated (`out`
+                 if given).
+    """
+    if img.dtype == np.uint8:
+        bins = (img.reshape(-1, 3) >> 3) + CHANNEL_OFFSETS
+        counts = np.bincount(bins.ravel(), minlength=NUM_FEATURES)
+    else:
+        counts = np.concatenate([np.histogram(img[:, :, c], bins=NUM_BINS, range=(0, 256))[0]
+                                 for c in range(3)])
+    if out is None:
+        return counts
+    out[:] = counts
+    return out
+
+
+def extract_features(image, out=None):
+    """ Computes the classifier's feature vector of a traffic light crop.
+
+    Only the color histograms are used, because bin spatial and HOG features
+    didn't add enough accuracy to justify the number of features.
+    """
+    return color_hist(image, out)
+
+
+def sliding_windows(height, width, sizes, stride):
+    """ Windows of a dense multi-scale search over an image.
+
+    Args:
+        height (int): Image height.
+        width (int): Image width.
+        sizes (list): (window height, window width) of each scale.
+        stride (int): Step between windows, in pixels.
+
+    Returns:
+        ndarray: (M, 4) windows as (top, left, bottom, right).
+    """
+    windows = [np.zeros((0, 4), dtype=int)]
+    for h, w in sizes:
+        if h > height or w > width:
+            continue
+        tops, lefts = np.mgrid[0:height - h + 1:stride, 0:width - w + 1:stride]
+        tops = tops.ravel()
+        lefts = lefts.ravel()
+        windows.append(np.stack([tops, lefts, tops + h, lefts + w], axis=1))
+    return np.concatenate(windows)
+
+
+class IntegralHistogram(object):
+    """ Color histograms of any window of an image in constant time.
+
+    Keeps one cumulative count plane per histogram bin (NUM_FEATURES planes):
+    `planes[y, x, b]` is the number of pixels above and left of (y, x) that
+    fall in bin b. The `color_hist` feature of a window is then four plane
+    lookups, whatever its size, instead of a pass over its pixels.
+
+    The build is not cheap: the planes take (H+1)*(W+1)*NUM_FEATURES*2
+    bytes, about 92MB for a full 800x600 frame, and building them takes
+    around 100-130ms there. Build it over the sub-region that is searched,
+    e.g. the band of rows the lights can appear in, not the whole frame;
+    `bench_integral_histogram.py` reports both costs for a given size.
+
+    The planes are uint16 and wrap around on large images. Window counts are
+    differences of the planes, so they are still exact for windows of fewer
+    than 65536 pixels.
+    """
+    def __init__(self, image):
+        """
+        Args:
+            image (ndarray): (H, W, 3) uint8 image.
+        """
+        h, w = image.shape[:2]
+        self.shape = (h, w)
+        planes = np.zeros((h + 1, w + 1, NUM_FEATURES), dtype=np.uint16)
+        # One-hot bins of every pixel, written through the flat index of
+        # (y + 1, x + 1, bin).
+        cells = (np.arange(1, h + 1)[:, None] * (w + 1) + np.arange(1, w + 1)) * NUM_FEATURES
+        bins = (image >> 3) + CHANNEL_OFFSETS
+        planes.ravel()[(cells[:, :, None] + bins).ravel()] = 1
+        # Row and column running sums. Adding whole rows (then columns) is
+        # several times faster than np.cumsum over the bin planes.
+        for y in range(1, h + 1):
+            planes[y] += planes[y - 1]
+        for x in range(1, w + 1):
+            planes[:, x] += planes[:, x - 1]
+        self.planes = planes
+
+    def features(self, top, left, bottom, right, out=None):
+        """ `color_hist` of image[top:bottom, left:right].
+        """
+        p = self.planes
+        counts = p[bottom, right] - p[top, right] - p[bottom, left] + p[top, left]
+        if out is None:
+            return counts.astype(np.int64)
+        out[:] = counts
+        return out
+
+    def features_batch(self, boxes):
+        """ `color_hist` of many windows at once.
+
+        Args:
+            boxes (ndarray): (M, 4) windows as (top, left, bottom, right).
+
+        Returns:
+            ndarray: (M, NUM_FEATURES) histograms.
+        """
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        t, l, b, r = boxes.T
+        p = self.planes
+        counts = p[b, r] - p[t, r] - p[b, l] + p[t, l]
+        return counts.astype(np.int64)
+
+    def crop_features(self, boxes):
+        """ Classifier features of many windows of any size.
+
+        The histograms are rescaled to the CROP_PIXELS of a resized crop, so
+        windows of every scale can be scored by the same model. This
+        approximates the histogram of the resized window; the interpolation
+        of the resize is not reproduced.
+
+        Args:
+            boxes (ndarray): (M, 4) windows as (top, left, bottom, right).
+
+        Returns:
+            ndarray: (M, NUM_FEATURES) float64 features.
+        """
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        features = self.features_batch(boxes).astype(np.float64)
+        features *= (CROP_PIXELS / np.maximum(areas, 1).astype(np.float64))[:, None]
+        return features
@@ -0,0 +1,118 @@
+import numpy as np
+
+'''
+NumPy-only inference of the exported traffic light SVM.
+
+`model/tl_classifier.py --export` writes the fitted scaler, the
+feature-selection mask and the libsvm parameters of the RBF SVC to an .npz
+file. `SVMPredictor` loads it and computes the same predictions and
+probabilities as the scikit-learn pipeline, so the node neither imports
+scikit-learn nor unpickles a model tied to its version:
+
+- predict: one-vs-one decision values of every class pair, then voting.
+- predict_proba: Platt scaling of each pair's decision value, then
+  libsvm's pairwise coupling of the pair probabilities.
+'''
+
+# Bounds of the pairwise probabilities and iteration limit, as in libsvm.
+MIN_PROB = 1e-7
+MAX_ITER = 100
+
+
+class SVMPredictor(object):
+    def __init__(self, path):
+        """
+        Args:
+            path (str): .npz file written by the export step.
+        """
+        model = np.load(path)
+        self.mean = model['mean']
+        self.scale = model['scale']
+        self.mask = model['mask']
+        self.support_vectors = model['support_vectors']
+        self.gamma = float(model['gamma'])
+        self.intercept = model['intercept']
+        self.prob_a = model['prob_a']
+        self.prob_b = model['prob_b']
+        self.classes_ = model['classes']
+
+        # Coefficients of every support vector in the decision value of each
+        # class pair (i, j), i < j, in libsvm's pair order.
+        n_support = model['n_support']
+        dual_coef = model['dual_coef']
+        starts = np.concatenate(([0], np.cumsum(n_support)))
+        k = len(self.classes_)
+        self.pairs = [(i, j) for i in range(k) for j in range(i + 1, k)]
+        self.pair_coef = np.zeros((len(self.pairs), len(self.support_vectors)))
+        for p, (i, j) in enumerate(self.pairs):
+            self.pair_coef[p, starts[i]:starts[i + 1]] = dual_coef[j - 1, starts[i]:starts[i + 1]]
+            self.pair_coef[p, starts[j]:starts[j + 1]] = dual_coef[i, starts[j]:starts[j + 1]]
+        self.sv_norms = np.sum(self.support_vectors ** 2, axis=1)
+
+    def decision_values(self, X):
+        """
+        Args:
+            X (array-like): (N, F) feature vectors.
+
+        Returns:
+            ndarray: (N, P) decision value of each class pair.
+        """
+        x = (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+        x = x[:, self.mask]
+        d2 = np.sum(x ** 2, axis=1)[:, None] + self.sv_norms - 2.0 * x.dot(self.support_vectors.T)
+        kernel = np.exp(-self.gamma * np.maximum(d2, 0.0))
+        return kernel.dot(self.pair_coef.T) + self.intercept
+
+    def predict(self, X):
+        dec = self.decision_values(X)
+        votes = np.zeros((len(dec), len(self.classes_)), dtype=int)
+        for p, (i, j) in enumerate(self.pairs):
+            votes[:, i] += dec[:, p] > 0
+            votes[:, j] += dec[:, p] <= 0
+        return self.classes_[np.argmax(votes, axis=1)]
+
+    def predict_proba(self, X):
+        dec = self.decision_values(X)
+        # Platt scaling, written to not overflow for either sign.
+        f = dec * self.prob_a + self.prob_b
+        pair_prob = np.where(f >= 0, np.exp(-np.abs(f)) / (1.0 + np.exp(-np.abs(f))),
+                             1.0 / (1.0 + np.exp(-np.abs(f))))
+        pair_prob = np.clip(pair_prob, MIN_PROB, 1.0 - MIN_PROB)
+
+        # scikit-learn's libsvm also couples the probabilities of two classes.
+        k = len(self.classes_)
+        proba = np.empty((len(dec), k))
+        r = np.zeros((k, k))
+        for n in range(len(dec)):
+            for p, (i, j) in enumerate(self.pairs):
+                r[i, j] = pair_prob[n, p]
+                r[j, i] = 1.0 - pair_prob[n, p]
+            proba[n] = couple_pairs(r)
+        return proba
+
+
+def couple_pairs(r):
+    """ Class probabilities from pairwise probabilities (libsvm's
+    `multiclass_probability`, method 2 of Wu, Lin and Weng 2004).
+
+    Args:
+        r (ndarray): (K, K) matrix, r[i, j] the probability of class i
+                     against class j.
+    """
+    k = len(r)
+    Q = -r.T * r
+    np.fill_diagonal(Q, np.sum(r ** 2, axis=0))
+    p = np.full(k, 1.0 / k)
+    eps = 0.005 / k
+    for _ in range(max(MAX_ITER, k)):
+        Qp = Q.dot(p)
+        pQp = p.dot(Qp)
+        if np.max(np.abs(Qp - pQp)) < eps:
+            break
+        for t in range(k):
+            diff = (-Qp[t] + pQp) / Q[t, t]
+            p[t] += diff
+            pQp = (pQp + diff * (diff * Q[t, t] + 2.0 * Qp[t])) / (1.0 + diff) / (1.0 + diff)
+            Qp = (Qp + diff * Q[t]) / (1.0 + diff)
+            p /= 1.0 + diff
+    return p
@@ -1,21 +1,48 @@
 from styx_msgs.msg import TrafficLight
 import numpy as np
-from sklearn.externals import joblib
+from light_classification.features import NUM_FEATURES, color_hist, extract_features
+from light_classification.svm_predictor import SVMPredictor
+from light_classification.color_cascade import ColorCascade
 import os 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 model_path = os.path.join(dir_path, "..", "..", "..", "..", "model", "svm.p")
+# Export of svm.p that needs only NumPy, see `model/tl_classifier.py --export`.
+npz_model_path = os.path.join(dir_path, "..", "..", "..", "..", "model", "svm.npz")
 
 CLASS_UNKNOWN=4
 CLASS_GREEN=2
 CLASS_YELLOW=1
 CLASS_RED=0
 
-class TLClassifier(object):
-    def __init__(self):
-        # Load the model
-        self.clf = joblib.load(model_path)
+# Probability given to the color decided by the color cascade.
+CASCADE_CONFIDENCE = 0.95
 
-        pass
+class TLClassifier(object):
+    def __init__(self, use_cascade=True, path=None):
+        """
+        Args:
+            use_cascade (bool): Decide crops with an unambiguous lamp color
+                                from HSV thresholds, without the SVM.
+            path (str): Model to load, an .npz export of the SVM or any pickled
+                        scikit-learn classifier. None loads svm.npz if present,
+                        else svm.p.
+        """
+        if path is None:
+            path = npz_model_path if os.path.isfile(npz_model_path) else model_path
+        self.model_path = path
+        # Load the model, scikit-learn is only imported for a pickled one.
+        if path.endswith(".npz"):
+            self.clf = SVMPredictor(path)
+            self.backend = "numpy"
+        else:
+            from sklearn.externals import joblib
+            self.clf = joblib.load(path)
+            self.backend = "scikit-learn"
+        # TrafficLight state of each column of the probabilities.
+        self.light_states = [self.to_light_state(c) for c in self.clf.classes_]
+        # Feature rows of `get_classifications`, grown on demand.
+        self.features = np.empty((4, NUM_FEATURES))
+        self.cascade = ColorCascade() if use_cascade else None
 
     def get_classification(self, image):
         """Determines the color of the traffic light in the image
@@ -27,10 +54,94 @@ class TLClassifier(object):
             int: ID of traffic light color (specified in styx_msgs/TrafficLight)
 
         """
+        probabilities = self.cascade_probabilities(image)
+        if probabilities is not None:
+            return self.state_from_probabilities(probabilities)
         x = self.extract_features_from_image(image)
         prediction = self.clf.predict([x])[0]
+        return self.to_light_state(prediction)
 
+    def get_probabilities(self, image):
+        """Determines the probability of every class for the traffic light in the image
 
+        Args:
+            image (cv::Mat): image containing the traffic light
+
+        Returns:
+            ndarray: probability of each class in `self.clf.classes_`
+
+        """
+        probabilities = self.cascade_probabilities(image)
+        if probabilities is not None:
+            return probabilities
+        x = self.extract_features_from_image(image)
+        return self.clf.predict_proba([x])[0]
+
+    def get_classifications(self, images):
+        """Determines the color of the traffic lights in several images at once
+
+        Images the color cascade cannot decide go into one feature matrix and
+        the model is run once, which is much cheaper per light than one call
+        per image.
+
+        Args:
+            images (list): images containing a traffic light each
+
+        Returns:
+            list: ID of traffic light color of each image (specified in styx_msgs/TrafficLight)
+            ndarray: (N, C) probability of each class in `self.clf.classes_`
+
+        """
+        probabilities = np.empty((len(images), len(self.light_states)))
+        undecided = []
+        for i, image in enumerate(images):
+            decided = self.cascade_probabilities(image)
+            if decided is None:
+                undecided.append(i)
+            else:
+                probabilities[i] = decided
+
+        n = len(undecided)
+        if n > 0:
+            if n > len(self.features):
+                self.features = np.empty((n, NUM_FEATURES))
+            x = self.features[:n]
+            for row, i in enumerate(undecided):
+                self.extract_features_from_image(images[i], x[row])
+            probabilities[undecided] = self.clf.predict_proba(x)
+        return [self.state_from_probabilities(p) for p in probabilities], probabilities
+
+    def cascade_probabilities(self, image):
+        """Runs the color cascade on the image
+
+        Returns:
+            ndarray: probability of each class in `self.clf.classes_`, None
+                     if the cascade is disabled or could not decide
+
+        """
+        if self.cascade is None:
+            return None
+        state = self.cascade.decide(image)
+        if state is None or state not in self.light_states:
+            return None
+        probabilities = np.full(len(self.light_states),
+                                (1.0 - CASCADE_CONFIDENCE) / max(len(self.light_states) - 1, 1))
+        probabilities[self.light_states.index(state)] = CASCADE_CONFIDENCE
+        return probabilities
+
+    def state_from_probabilities(self, probabilities):
+        """Gets the traffic light color of the most probable class
+
+        Args:
+            probabilities (ndarray): result of `get_probabilities`
+
+        Returns:
+            int: ID of traffic light color (specified in styx_msgs/TrafficLight)
+
+        """
+        return self.to_light_state(self.clf.classes_[np.argmax(probabilities)])
+
+    def to_light_state(self, prediction):
         if (prediction == CLASS_GREEN):
             return TrafficLight.GREEN
         elif (prediction == CLASS_RED):
@@ -38,25 +149,17 @@ class TLClassifier(object):
         elif (prediction == CLASS_YELLOW):
             return TrafficLight.YELLOW
         else:
-            TrafficLight.UNKNOWN
+            return TrafficLight.UNKNOWN
 
 
-    # Define a function to compute color histogram features (from udacity lectures).
-    def color_hist(self, img, nbins=32, bins_range=(0, 256)):
+    def color_hist(self, img, out=None):
         """
         Computes histogram features on each channel in the image, returning a single flat array of features.
         """
-        # Compute the histogram of the color channels separately
-        channel1_hist = np.histogram(img[:, :, 0], bins=nbins, range=bins_range)
-        channel2_hist = np.histogram(img[:, :, 1], bins=nbins, range=bins_range)
-        channel3_hist = np.histogram(img[:, :, 2], bins=nbins, range=bins_range)
-        # Concatenate the histograms into a single feature vector
-        return np.concatenate((channel1_hist[0], channel2_hist[0], channel3_hist[0]))
+        return color_hist(img, out)
 
-    def extract_features_from_image(self, image):
+    def extract_features_from_image(self, image, out=None):
         """
-        This method runs HOG only, because bin spatial and color histograms didn't add enough accuracy to justify the
-        number of features.
+        Computes the feature vector shared with the training script, see `light_classification.features`.
         """
-        return self.color_hist(image)
-
+        return extract_features(image, out)
@@ -0,0 +1,97 @@
+import numpy as np
+
+from styx_msgs.msg import TrafficLight
+
+'''
+Bayes filter over the state of the traffic light ahead.
+
+The hidden state is the color of the light (or UNKNOWN when no light can be
+seen). Between two frames a light mostly keeps its color and otherwise
+follows its cycle GREEN -> YELLOW -> RED -> GREEN; other changes are
+treated as very unlikely instead of impossible, so a wrong belief can
+still recover. Each frame's classifier probabilities are the observation.
+
+The filtered state changes as soon as the posterior of a color passes the
+confidence threshold. A confident classification is therefore used on its
+first frame, while a single misclassified frame against an established
+color does not flip the state.
+'''
+
+STATES = [TrafficLight.RED, TrafficLight.YELLOW, TrafficLight.GREEN, TrafficLight.UNKNOWN]
+RED, YELLOW, GREEN, UNKNOWN = range(len(STATES))
+
+# Per-frame probability of a change that does not follow the light cycle.
+UNLIKELY = 1e-3
+
+# Weight of a uniform observation mixed into each classification, so that
+# no frame can rule out a state on its own.
+OBSERVATION_FLOOR = 0.05
+
+
+def transition_matrix(change_prob):
+    """ Build the per-frame transition matrix, T[i, j] = P(j at t+1 | i at t).
+
+    Args:
+        change_prob (double): Probability per frame that a light moves on in
+                              its cycle, or appears / disappears.
+    """
+    k = len(STATES)
+    T = np.full((k, k), UNLIKELY)
+    for i, j in [(GREEN, YELLOW), (YELLOW, RED), (RED, GREEN)]:
+        T[i, j] = change_prob
+    T[:, UNKNOWN] = change_prob
+    T[UNKNOWN, :] = change_prob
+    np.fill_diagonal(T, 0.0)
+    np.fill_diagonal(T, 1.0 - T.sum(axis=1))
+    return T
+
+
+class LightStateFilter(object):
+    def __init__(self, threshold=0.8, change_prob=0.05):
+        """
+        Args:
+            threshold (double): Posterior a state needs to become the filtered state.
+            change_prob (double): See `transition_matrix`.
+        """
+        self.threshold = threshold
+        self.transition = transition_matrix(change_prob)
+        self.reset()
+
+    def reset(self):
+        """ Forget the belief, e.g. when the next light comes into view.
+        """
+        self.posterior = np.full(len(STATES), 1.0 / len(STATES))
+        self.state = TrafficLight.UNKNOWN
+
+    def observation(self, states, probabilities):
+        """ Map classifier probabilities to the filter's state order.
+
+        Args:
+            states (list): TrafficLight state of each classifier class.
+            probabilities (array-like): Probability of each classifier class,
+                                        None if no light was classified.
+        Returns:
+            ndarray: Likelihood of each of STATES.
+        """
+        likelihood = np.zeros(len(STATES))
+        if probabilities is None:
+            likelihood[UNKNOWN] = 1.0
+        else:
+            for state, p in zip(states, probabilities):
+                likelihood[STATES.index(state)] += p
+        return (1.0 - OBSERVATION_FLOOR) * likelihood + OBSERVATION_FLOOR / len(STATES)
+
+    def update(self, likelihood):
+        """ Fold one frame's observation into the belief.
+
+        Args:
+            likelihood (ndarray): Likelihood of each of STATES, see `observation`.
+        Returns:
+            int: The filtered TrafficLight state.
+        """
+        posterior = self.posterior.dot(self.transition) * likelihood
+        self.posterior = posterior / posterior.sum()
+        best = int(np.argmax(self.posterior))
+        if self.posterior[best] >= self.threshold:
+            self.state = STATES[best]
+        return self.state
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+from light_classification.color_cascade import HUE_BANDS, MIN_SATURATION, MIN_VALUE
+
+'''
+Traffic light candidates from the whole camera frame, for the site where no
+light poses are published.
+
+The frame is subsampled, converted to HSV once and thresholded into one mask
+per lamp color (the bands of the color cascade). Connected components of each
+mask that have the size and shape of a lit lamp are candidates. Each one is
+turned into the box of the housing around it, using the lamp's color for its
+position in the housing (red top, yellow middle, green bottom). Only these
+boxes are cropped and classified.
+
+The components of a mask and their areas and bounding boxes come from one
+OpenCV call and are filtered as arrays, so the time depends on the frame
+size, not on how cluttered the frame is. The budget is about 8 ms for an
+800x600 frame (step 2) and under 15 ms on pure noise, within the camera
+period.
+'''
+
+# Housing size in lamp diameters.
+HOUSING_WIDTH = 1.6
+HOUSING_HEIGHT = 3.6
+
+
+class LightProposer(object):
+    def __init__(self, step=2, min_area=3, max_area=600, max_candidates=4):
+        """
+        Args:
+            step (int): Subsampling of the frame before thresholding.
+            min_area (int): Smallest lamp area, in subsampled pixels.
+            max_area (int): Largest lamp area, in subsampled pixels.
+            max_candidates (int): Number of largest candidates returned.
+        """
+        self.step = step
+        self.min_area = min_area
+        self.max_area = max_area
+        self.max_candidates = max_candidates
+
+    def propose(self, image):
+        """ Find traffic light candidates.
+
+        Args:
+            image (ndarray): BGR camera frame.
+
+        Returns:
+            ndarray: (M, 4) int boxes (top, left, bottom, right) of the
+                     candidate housings, largest lamp first.
+        """
+        small = np.ascontiguousarray(image[::self.step, ::self.step])
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hue = hsv[:, :, 0]
+        lit = (hsv[:, :, 1] >= MIN_SATURATION) & (hsv[:, :, 2] >= MIN_VALUE)
+
+        candidates = []
+        for slot, (_, bands) in enumerate(HUE_BANDS):
+            mask = np.zeros_like(lit)
+            for lo, hi in bands:
+                mask |= (hue >= lo) & (hue <= hi)
+            mask &= lit
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask.view(np.uint8),
+                                                              connectivity=4)
+            stats = stats[1:]
+            area = stats[:, cv2.CC_STAT_AREA]
+            h = stats[:, cv2.CC_STAT_HEIGHT]
+            w = stats[:, cv2.CC_STAT_WIDTH]
+            # Lamps are round: about as wide as tall and mostly filled.
+            lamps = np.nonzero((area >= self.min_area) & (area <= self.max_area) &
+                               (np.maximum(h, w) <= 2 * np.minimum(h, w)) &
+                               (area >= 0.4 * h * w))[0]
+            # Only the largest ones can make it into the candidates.
+            lamps = lamps[np.argsort(-area[lamps], kind='mergesort')[:self.max_candidates]]
+            for i in lamps:
+                cy = stats[i, cv2.CC_STAT_TOP] + h[i] / 2.0
+                cx = stats[i, cv2.CC_STAT_LEFT] + w[i] / 2.0
+                candidates.append((area[i], slot, cy, cx, max(h[i], w[i])))
+
+        candidates.sort(key=lambda c: -c[0])
+        boxes = []
+        for _, slot, cy, cx, d in candidates[:self.max_candidates]:
+            cy, cx, d = cy * self.step, cx * self.step, d * self.step
+            top = cy - (slot + 0.5) * HOUSING_HEIGHT / 3.0 * d
+            left = cx - HOUSING_WIDTH / 2.0 * d
+            boxes.append((top, left, top + HOUSING_HEIGHT * d, left + HOUSING_WIDTH * d))
+        boxes = np.array(boxes, dtype=int).reshape(-1, 4)
+        boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, image.shape[0])
+        boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, image.shape[1])
+        return boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+
+import numpy as np
+
+from styx_msgs.msg import TrafficLight
+from light_filter import LightStateFilter
+
+'''
+Replays a simulated light cycle through the state estimators of tl_detector:
+
+    python replay_light_filter.py --accuracy 0.85
+
+A light cycles GREEN -> YELLOW -> RED with gaps in which no light is seen. A
+noisy classifier (right with probability --accuracy, otherwise a random other
+color, confidence drawn at random) produces probabilities for each frame.
+Both the old STATE_COUNT_THRESHOLD debounce and `LightStateFilter` are run
+on the same frames. For each one the script reports the latency (frames from
+a change of the light to the published state following it, for red onsets
+and for all changes) and the number of frames published as red while the
+light was not red, and vice versa. Exits with status 1 if the filter does
+not beat the debounce on both red latency and false red frames.
+'''
+
+COLORS = [TrafficLight.RED, TrafficLight.YELLOW, TrafficLight.GREEN]
+# Frames of each phase at the camera rate.
+PHASES = [(TrafficLight.GREEN, 60), (TrafficLight.YELLOW, 20), (TrafficLight.RED, 60)]
+NO_LIGHT_FRAMES = 30
+
+STATE_COUNT_THRESHOLD = 3
+
+
+def simulate(cycles, accuracy, rng):
+    """
+    Returns:
+        list: True state of every frame.
+        list: Classifier probabilities (over COLORS) of every frame, None without a light.
+    """
+    truth = []
+    probabilities = []
+    for _ in range(cycles):
+        truth += [TrafficLight.UNKNOWN] * NO_LIGHT_FRAMES
+        probabilities += [None] * NO_LIGHT_FRAMES
+        # Each light comes into view in a random phase.
+        start = rng.randint(len(PHASES))
+        for color, frames in PHASES[start:] + PHASES[:start]:
+            for _ in range(frames):
+                if rng.rand() < accuracy:
+                    predicted = color
+                else:
+                    predicted = rng.choice([c for c in COLORS if c != color])
+                p = np.full(len(COLORS), 0.0)
+                confidence = rng.uniform(0.5, 0.95)
+                p[:] = (1.0 - confidence) / (len(COLORS) - 1)
+                p[COLORS.index(predicted)] = confidence
+                truth.append(color)
+                probabilities.append(p)
+    return truth, probabilities
+
+
+def label(p):
+    return TrafficLight.UNKNOWN if p is None else COLORS[int(np.argmax(p))]
+
+
+def run_debounce(probabilities):
+    """ The STATE_COUNT_THRESHOLD logic tl_detector used before the filter.
+    """
+    published = []
+    state = last_state = TrafficLight.UNKNOWN
+    state_count = 0
+    for p in probabilities:
+        detected = label(p)
+        if state != detected:
+            state_count = 0
+            state = detected
+        elif state_count >= STATE_COUNT_THRESHOLD:
+            last_state = state
+        state_count += 1
+        published.append(last_state)
+    return published
+
+
+def run_filter(probabilities, threshold, change_prob):
+    light_filter = LightStateFilter(threshold, change_prob)
+    published = []
+    visible = False
+    for p in probabilities:
+        # tl_detector resets the filter when a different light comes into view.
+        if (p is not None) != visible:
+            light_filter.reset()
+            visible = p is not None
+        published.append(light_filter.update(light_filter.observation(COLORS, p)))
+    return published
+
+
+def latencies(truth, published, to_state=None):
+    result = []
+    for t in range(1, len(truth)):
+        if truth[t] == truth[t - 1] or (to_state is not None and truth[t] != to_state):
+            continue
+        k = t
+        while k < len(truth) and truth[k] == truth[t] and published[k] != truth[t]:
+            k += 1
+        if k < len(truth) and truth[k] == truth[t]:
+            result.append(k - t)
+    return result
+
+
+def evaluate(truth, published):
+    """ Scores the states an estimator published against the true states.
+
+    Returns:
+        dict: Mean and p95 red onset and any change latency (frames), and the
+              false red and missed red frame counts.
+    """
+    red = latencies(truth, published, TrafficLight.RED)
+    changes = latencies(truth, published)
+    truth_red = np.array(truth) == TrafficLight.RED
+    published_red = np.array(published) == TrafficLight.RED
+    return {
+        "red_latency": np.mean(red),
+        "red_latency_p95": np.percentile(red, 95),
+        "any_latency": np.mean(changes),
+        "any_latency_p95": np.percentile(changes, 95),
+        "false_red": int(np.sum(published_red & ~truth_red)),
+        "missed_red": int(np.sum(truth_red & ~published_red))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Light state filter replay')
+    parser.add_argument('--cycles', type=int, default=200, help='lights passed')
+    parser.add_argument('--accuracy', type=float, default=0.85, help='classifier accuracy per frame')
+    parser.add_argument('--threshold', type=float, default=0.8, help='filter confidence threshold')
+    parser.add_argument('--change-prob', type=float, default=0.05, help='filter change probability')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    truth, probabilities = simulate(args.cycles, args.accuracy, np.random.RandomState(args.seed))
+
+    print("frames: {}, classifier accuracy: {}".format(len(truth), args.accuracy))
+    print("{:<10} {:>14} {:>14} {:>10} {:>10}".format(
+        "estimator", "red latency", "any latency", "false red", "missed red"))
+    scores = {}
+    for name, published in [
+            ("debounce", run_debounce(probabilities)),
+            ("filter", run_filter(probabilities, args.threshold, args.change_prob))]:
+        score = scores[name] = evaluate(truth, published)
+        print("{:<10} {:>8.2f} (p95 {:>2.0f}) {:>6.2f} (p95 {:>2.0f}) {:>10} {:>10}".format(
+            name, score["red_latency"], score["red_latency_p95"], score["any_latency"],
+            score["any_latency_p95"], score["false_red"], score["missed_red"]))
+
+    if (scores["filter"]["red_latency"] >= scores["debounce"]["red_latency"] or
+            scores["filter"]["false_red"] > scores["debounce"]["false_red"]):
+        print("FAIL: the filter does not beat the debounce")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from styx_msgs.msg import TrafficLight
+from light_classification.color_cascade import ColorCascade
+
+'''
+Report of the color cascade in front of the SVM:
+
+    python report_color_cascade.py [--no-svm]
+
+Runs the labelled crops of `data/training_data` through the cascade alone,
+the SVM alone and the combined classifier. Reports the fraction of crops
+that skip the SVM, the accuracy of each stage and the time per crop. With
+--no-svm only the cascade is measured (no model needed).
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+default_path = os.path.join(dir_path, "..", "..", "..", "data", "training_data")
+
+# Folder of each class in the training data.
+FOLDERS = [("red_lights", TrafficLight.RED), ("yellow_lights", TrafficLight.YELLOW),
+           ("green_lights", TrafficLight.GREEN), ("no_light", TrafficLight.UNKNOWN)]
+
+
+def load_crops(path):
+    crops = []
+    labels = []
+    for folder, state in FOLDERS:
+        for image_uri in sorted(glob.glob(os.path.join(path, folder, "*.png"))):
+            image = cv2.imread(image_uri)
+            crops.append(cv2.resize(image, (30, 60), interpolation=cv2.INTER_AREA))
+            labels.append(state)
+    return crops, np.array(labels)
+
+
+def timed(fn, crops):
+    start_time = time.time()
+    result = np.array([fn(crop) for crop in crops])
+    return result, (time.time() - start_time) / len(crops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Color cascade report')
+    parser.add_argument('--path', default=default_path, help='training image folder')
+    parser.add_argument('--no-svm', action='store_true', help='only measure the cascade')
+    args = parser.parse_args()
+
+    crops, labels = load_crops(args.path)
+    cascade = ColorCascade()
+    decisions, cascade_time = timed(lambda crop: cascade.decide(crop), crops)
+    decided = np.array([d is not None for d in decisions])
+
+    print("crops: {}".format(len(crops)))
+    print("skip SVM:          {:.1%}".format(np.mean(decided)))
+    print("cascade accuracy:  {:.1%} of decided crops, {:.1f}us/crop".format(
+        np.mean(decisions[decided] == labels[decided]) if decided.any() else 0.0,
+        1e6 * cascade_time))
+    for folder, state in FOLDERS:
+        of_class = labels == state
+        print("  {:<14} skip {:.1%}".format(folder, np.mean(decided[of_class]) if of_class.any() else 0.0))
+    if args.no_svm:
+        return
+
+    from light_classification.tl_classifier import TLClassifier
+    svm_only = TLClassifier(use_cascade=False)
+    combined = TLClassifier(use_cascade=True)
+    svm_states, svm_time = timed(svm_only.get_classification, crops)
+    combined_states, combined_time = timed(combined.get_classification, crops)
+    print("SVM accuracy:      {:.1%}, {:.1f}us/crop".format(np.mean(svm_states == labels), 1e6 * svm_time))
+    print("cascade + SVM:     {:.1%}, {:.1f}us/crop".format(
+        np.mean(combined_states == labels), 1e6 * combined_time))
+
+
+if __name__ == '__main__':
+    main()
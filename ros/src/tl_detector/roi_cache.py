@@ -0,0 +1,90 @@
+import numpy as np
+
+'''
+Per-light cache of classification results keyed on the light's ROI.
+
+While the car waits at a light, the crop of the light hardly changes from
+one frame to the next. Each classified crop is reduced to a small signature
+(the mean color of 5x5 pixel blocks of the 60x30 ROI). A later crop of the
+same light whose signature differs from the cached one by less than
+`max_diff` on average (mean absolute difference, in 0-255 intensity units)
+reuses the cached probabilities. Entries older than `max_age` seconds are
+reclassified anyway, which bounds how stale a result can get.
+'''
+
+# Side (pixels) of the blocks averaged into the signature.
+BLOCK = 5
+
+
+def roi_signature(roi):
+    """ Downsampled signature of a resized ROI, None if it is empty.
+    """
+    rows, cols = roi.shape[:2]
+    rows -= rows % BLOCK
+    cols -= cols % BLOCK
+    if rows == 0 or cols == 0:
+        return None
+    blocks = roi[:rows, :cols].reshape(rows // BLOCK, BLOCK, cols // BLOCK, BLOCK, -1)
+    return blocks.mean(axis=(1, 3))
+
+
+class ROICache(object):
+    def __init__(self, max_diff=4.0, max_age=1.0):
+        """
+        Args:
+            max_diff (double): Mean absolute signature difference under which a
+                               crop counts as unchanged.
+            max_age (double): Seconds a result is reused at most.
+        """
+        self.max_diff = max_diff
+        self.max_age = max_age
+        # key -> (signature, probabilities, time)
+        self.entries = {}
+
+        self.lookups = 0
+        self.hits = 0
+        # Mean cost (s) of classifying one light, to estimate the CPU saved.
+        self.classified = 0
+        self.classify_time = 0.0
+
+    def lookup(self, key, roi, now):
+        """ Look up the result of a crop.
+
+        Args:
+            key: Identifies the light, e.g. its index in the light list.
+            roi (ndarray): Resized ROI of the light.
+            now (double): Time (s) of the frame.
+
+        Returns:
+            (ndarray, ndarray): The cached probabilities (None on a miss) and
+                                the crop's signature, to `store` after a miss.
+        """
+        self.lookups += 1
+        signature = roi_signature(roi)
+        entry = self.entries.get(key)
+        if (signature is not None and entry is not None and
+                entry[0].shape == signature.shape and
+                0.0 <= now - entry[2] <= self.max_age and
+                np.mean(np.abs(signature - entry[0])) < self.max_diff):
+            self.hits += 1
+            return entry[1], signature
+        return None, signature
+
+    def store(self, key, signature, probabilities, now):
+        if signature is not None:
+            self.entries[key] = (signature, probabilities, now)
+
+    def record_cost(self, elapsed, count):
+        """ Account `elapsed` seconds spent classifying `count` lights.
+        """
+        self.classified += count
+        self.classify_time += elapsed
+
+    def stats(self):
+        cost = self.classify_time / self.classified if self.classified else 0.0
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / float(max(self.lookups, 1)),
+            "cpu_saved_s": self.hits * cost
+        }
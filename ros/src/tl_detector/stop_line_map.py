@@ -0,0 +1,84 @@
+import os
+import hashlib
+
+import numpy as np
+import yaml
+
+'''
+Maps stop lines and traffic lights to track waypoints.
+
+The mapping only depends on the map, so it is computed once when
+`/base_waypoints` arrives and each camera frame then only looks up the
+stop-line waypoint of a light. The result is also written next to the map
+file, so the next start with the same map and config skips the queries.
+'''
+
+
+class StopLineMap(object):
+    def __init__(self, index, stop_line_positions, cache_path=None):
+        """
+        Args:
+            index (WaypointIndex): Index of the track waypoints.
+            stop_line_positions (list): [x, y] of every stop line.
+            cache_path (str): File to persist the mapping to, or None.
+        """
+        self.index = index
+        self.stop_lines = np.asarray(stop_line_positions, dtype=np.float64).reshape(-1, 2)
+        self.cache_path = cache_path
+        self.digest = hashlib.md5(index.xy.tobytes() + self.stop_lines.tobytes()).hexdigest()
+
+        # Position of every light and the stop line it belongs to.
+        self.light_xy = np.empty((0, 2))
+        self.light_stop_lines = np.empty(0, dtype=int)
+
+        self.warm_start = self.load()
+        if not self.warm_start:
+            _, self.stop_line_wps = index.closest_batch(self.stop_lines)
+            self.save()
+
+    def map_lights(self, light_xy):
+        """ Assign every traffic light to its stop line.
+
+        Only does work when the set of lights changes.
+
+        Args:
+            light_xy (array-like): (M, 2) positions of the lights.
+
+        Returns:
+            ndarray: Stop-line waypoint id of every light.
+        """
+        light_xy = np.asarray(light_xy, dtype=np.float64).reshape(-1, 2)
+        if light_xy.shape != self.light_xy.shape or not np.allclose(light_xy, self.light_xy):
+            diff = light_xy[:, None, :] - self.stop_lines[None, :, :]
+            self.light_stop_lines = np.argmin(np.sum(diff ** 2, axis=2), axis=1)
+            self.light_xy = light_xy
+            self.save()
+        return self.stop_line_wps[self.light_stop_lines]
+
+    def load(self):
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return False
+        with open(self.cache_path) as f:
+            cache = yaml.safe_load(f)
+        if not cache or cache.get('digest') != self.digest:
+            return False
+        self.stop_line_wps = np.array(cache['stop_line_wps'], dtype=int)
+        self.light_xy = np.array(cache['light_xy'], dtype=np.float64).reshape(-1, 2)
+        self.light_stop_lines = np.array(cache['light_stop_lines'], dtype=int)
+        return True
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        cache = {
+            'digest': self.digest,
+            'stop_line_wps': [int(wp) for wp in self.stop_line_wps],
+            'light_xy': self.light_xy.tolist(),
+            'light_stop_lines': [int(i) for i in self.light_stop_lines]
+        }
+        try:
+            with open(self.cache_path, 'w') as f:
+                yaml.safe_dump(cache, f)
+        except (IOError, OSError):
+            # Read-only map directory: no warm start next time.
+            self.cache_path = None
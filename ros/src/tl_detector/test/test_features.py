@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from light_classification.features import NUM_FEATURES, color_hist
+from bench_features import default_path, legacy_color_hist
+
+
+class ColorHistTest(unittest.TestCase):
+    """ `color_hist` gives the same counts as the np.histogram calls it replaced.
+    """
+    def assert_same_hist(self, image):
+        expected = legacy_color_hist(image)
+        np.testing.assert_array_equal(color_hist(image), expected)
+        out = np.empty(NUM_FEATURES)
+        self.assertIs(color_hist(image, out), out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_training_crops(self):
+        uris = sorted(glob.glob(os.path.join(default_path, "*", "*.png")))
+        if not uris:
+            self.skipTest("no training images")
+        for uri in uris:
+            self.assert_same_hist(cv2.imread(uri))
+
+    def test_random_images(self):
+        rng = np.random.RandomState(0)
+        for _ in range(200):
+            h, w = rng.randint(1, 80, 2)
+            self.assert_same_hist(rng.randint(0, 256, (h, w, 3)).astype(np.uint8))
+
+    def test_every_bin_edge(self):
+        self.assert_same_hist(np.arange(256, dtype=np.uint8).reshape(16, 16, 1).repeat(3, axis=2))
+
+    def test_strided_views(self):
+        # Like the ROIs cut out of a frame.
+        frame = np.random.RandomState(1).randint(0, 256, (600, 800, 3)).astype(np.uint8)
+        self.assert_same_hist(frame[100:160, 300:330])
+        self.assert_same_hist(frame[::3, ::5])
+
+    def test_empty_crop(self):
+        frame = np.zeros((600, 800, 3), dtype=np.uint8)
+        self.assert_same_hist(frame[:0, :0])
+
+if __name__ == '__main__':
+    unittest.main()
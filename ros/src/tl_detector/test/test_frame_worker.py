@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from frame_worker import LatestFrameWorker
+
+
+class LatestFrameWorkerTest(unittest.TestCase):
+    def test_frame_after_error_is_processed(self):
+        processed = []
+        errors = []
+        done = threading.Event()
+
+        def process(frame):
+            if frame == 1:
+                raise KeyError('bgr16')
+            processed.append(frame)
+            done.set()
+
+        worker = LatestFrameWorker(process, errors.append)
+        worker.submit(1)
+        # Wait for the failing frame to be taken, so the next one is not dropped.
+        while worker.processed < 1:
+            time.sleep(0.01)
+        worker.submit(2)
+        self.assertTrue(done.wait(2.0))
+        worker.stop()
+
+        self.assertEqual(processed, [2])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('KeyError', errors[0])
+        self.assertEqual(worker.stats()["errors"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
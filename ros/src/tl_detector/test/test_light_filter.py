@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+try:
+    from replay_light_filter import simulate, run_debounce, run_filter, evaluate
+except ImportError:
+    # The light states come from styx_msgs.
+    simulate = None
+
+
+@unittest.skipIf(simulate is None, "needs the ROS Python packages")
+class LightStateFilterReplayTest(unittest.TestCase):
+    def test_filter_beats_debounce(self):
+        truth, probabilities = simulate(50, 0.85, np.random.RandomState(0))
+        debounce = evaluate(truth, run_debounce(probabilities))
+        light_filter = evaluate(truth, run_filter(probabilities, 0.8, 0.05))
+
+        self.assertLess(light_filter["red_latency"], debounce["red_latency"])
+        self.assertLess(light_filter["false_red"], debounce["false_red"])
+        self.assertLess(light_filter["missed_red"], debounce["missed_red"])
+
+if __name__ == '__main__':
+    unittest.main()
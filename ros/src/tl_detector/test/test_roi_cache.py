@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "waypoint_updater"))
+from roi_cache import ROICache
+from timing import Timings
+try:
+    from tl_detector import TLDetector
+except ImportError:
+    # The node needs the ROS Python packages.
+    TLDetector = None
+
+# Fields of sensor_msgs/Image that `decode_roi` reads.
+ImageMsg = namedtuple('ImageMsg', 'height width step encoding data')
+
+
+class Stamp(object):
+    def __init__(self, secs):
+        self.secs = secs
+
+    def to_sec(self):
+        return self.secs
+
+
+class CountingClassifier(object):
+    """ Classifies a crop by its mean color and counts the crops it sees.
+    """
+    def __init__(self):
+        self.classified = 0
+
+    def get_classifications(self, images):
+        self.classified += len(images)
+        probabilities = [np.array([image.mean() / 255.0, 1.0 - image.mean() / 255.0]) for image in images]
+        return [self.state_from_probabilities(p) for p in probabilities], probabilities
+
+    def state_from_probabilities(self, probabilities):
+        return int(np.argmax(probabilities))
+
+
+@unittest.skipIf(TLDetector is None, "needs the ROS Python packages")
+class LightStatesCacheTest(unittest.TestCase):
+    def make_detector(self, boxes):
+        # Only the state process_traffic_lights uses, without starting the node.
+        detector = TLDetector.__new__(TLDetector)
+        detector.timings = Timings()
+        detector.roi_cache = ROICache()
+        detector.light_classifier = CountingClassifier()
+        detector.bytes_saved = 0
+        # Two visible lights in front of the same stop line.
+        detector.find_lights = lambda stamp: ([0, 1], [120, 120], boxes)
+        frame = np.zeros((600, 800, 3), dtype=np.uint8)
+        frame[100:160, 100:130] = 220
+        frame[100:160, 500:530] = 30
+        detector.camera_image = ImageMsg(600, 800, 800 * 3, 'bgr8', frame.tobytes())
+        return detector
+
+    def test_lights_on_same_stop_line_are_cached_apart(self):
+        boxes = np.array([[100, 100, 160, 130], [100, 500, 160, 530]])
+        detector = self.make_detector(boxes)
+
+        first_wp, first = detector.process_traffic_lights(Stamp(0.0))
+        light_wp, probabilities = detector.process_traffic_lights(Stamp(0.1))
+
+        # The second frame is served from the cache, each light with its own entry.
+        self.assertEqual(detector.light_classifier.classified, 2)
+        self.assertEqual(light_wp, first_wp)
+        np.testing.assert_array_equal(probabilities, first)
+        self.assertEqual(len(detector.roi_cache.entries), 2)
+
+    def test_pool_result_caches_every_light_and_picks_a_known_one(self):
+        detector = self.make_detector(None)
+        published = []
+        detector.update_state = lambda light_wp, p, stamp: published.append((light_wp, p))
+        # The closest light was not classified, the next one was.
+        signatures = [np.zeros((12, 6, 3)), np.ones((12, 6, 3))]
+        meta = ([0, 1], [120, 140], Stamp(0.0), signatures, [None, None])
+
+        detector.publish_result(meta, [None, np.array([0.9, 0.1])], 0.01)
+
+        self.assertEqual(published[0][0], 140)
+        self.assertEqual(list(detector.roi_cache.entries), [1])
+        self.assertEqual(detector.roi_cache.classified, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,28 +5,83 @@ from std_msgs.msg import Int32
 from geometry_msgs.msg import PoseStamped, Pose, Point
 from styx_msgs.msg import TrafficLightArray, TrafficLight
 from styx_msgs.msg import Lane
-from sensor_msgs.msg import Image
-from cv_bridge import CvBridge
+from sensor_msgs.msg import Image, CameraInfo
 from light_classification.tl_classifier import TLClassifier
-import tf
+from light_classification.classifier_pool import ClassifierPool
 #from math import inf
 import numpy as np
 import cv2
 import yaml
 import math
 import time
-
-STATE_COUNT_THRESHOLD = 3
+import os
+import sys
+import bisect
+import threading
+import traceback
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(dir_path, "..", "waypoint_updater"))
+from waypoint_index import WaypointIndex
+from stop_line_map import StopLineMap
+from image_roi import decode_roi, resize_image
+from camera_model import CameraModel, PoseHistory
+from frame_worker import LatestFrameWorker
+from light_filter import LightStateFilter
+from roi_cache import ROICache
+from light_proposals import LightProposer
+from collections import namedtuple
+from timing import Timings
+from diagnostics import TimingReporter
+
+# Result of processing one camera frame, `stamp` is the stamp of that frame.
+Detection = namedtuple('Detection', 'light_wp state stamp')
+
+# How far ahead (in meters along the track) the car tries to capture a light.
+LIGHT_HORIZON = 100.0
+
+# Number of upcoming lights tested against the camera frustum.
+LIGHT_CANDIDATES = 2
 
 class TLDetector(object):
     def __init__(self):
         rospy.init_node('tl_detector')
 
-        self.image_count = 467
+        # Callback timings, published on /diagnostics.
+        self.timings = Timings()
+        self.timing_reporter = TimingReporter(self.timings)
+        self.timing_reporter.add_source('image_gate', self.image_gate_summary)
+
         self.pose = None
         self.waypoints = None
+        self.wp_index = None
+        self.stop_line_map = None
         self.camera_image = None
         self.lights = []
+        # Stop-line waypoint of every light in self.lights.
+        self.light_stop_wps = None
+        # Light indices sorted by stop-line waypoint, and those waypoints.
+        self.light_order = []
+        self.light_order_wps = []
+
+        # Frames with no light ahead are not decoded at all, the others
+        # only decode the light's ROI.
+        self.frames = 0
+        self.frames_skipped = 0
+        self.bytes_saved = 0
+
+        config_string = rospy.get_param("/traffic_light_config")
+        self.config = yaml.load(config_string)
+
+        # Intrinsics from the config until /camera_info (if any) arrives, and
+        # the car poses to match image stamps against.
+        self.camera = CameraModel.from_config(self.config['camera_info'])
+        self.pose_history = PoseHistory()
+
+        # The site has no /vehicle/traffic_lights, lights are searched for in
+        # the whole frame instead.
+        self.is_site = self.config.get('is_site', False)
+        self.light_proposer = LightProposer() if self.is_site else None
 
         #  can be used used to determine the vehicle's location.
         sub1 = rospy.Subscriber('/current_pose', PoseStamped, self.pose_cb)
@@ -41,337 +96,466 @@ class TLDetector(object):
         rely on the position of the light and the camera image to predict it.
         '''
         sub3 = rospy.Subscriber('/vehicle/traffic_lights', TrafficLightArray, self.traffic_cb)
-
-        # provides an image stream from the car's camera. These images are used to determine the color of upcoming traffic lights.
-        sub6 = rospy.Subscriber('/image_color', Image, self.image_cb)
-
-        config_string = rospy.get_param("/traffic_light_config")
-        self.config = yaml.load(config_string)
+        sub4 = rospy.Subscriber('/camera_info', CameraInfo, self.camera_info_cb)
 
         self.upcoming_red_light_pub = rospy.Publisher('/traffic_waypoint', Int32, queue_size=1)
 
-        self.bridge = CvBridge()
-        self.light_classifier = TLClassifier()
-        self.listener = tf.TransformListener()
-
+        # ~classifier_model selects the model file, e.g. one picked by
+        # model/tl_classifier.py --models, default svm.npz (or svm.p).
+        self.light_classifier = TLClassifier(rospy.get_param('~color_cascade', True),
+                                             rospy.get_param('~classifier_model', None) or None)
+        rospy.loginfo('Light classifier: {} ({})'.format(self.light_classifier.model_path,
+                                                         self.light_classifier.backend))
+
+        # Filtered state of the light ahead, published once its posterior
+        # passes ~light_confidence.
+        self.light_filter = LightStateFilter(rospy.get_param('~light_confidence', 0.8),
+                                             rospy.get_param('~light_change_prob', 0.05))
+        self.filter_wp = -1
+
+        # Results of unchanged light crops are reused for up to ~roi_cache_age s.
+        self.roi_cache = ROICache(rospy.get_param('~roi_cache_diff', 4.0),
+                                  rospy.get_param('~roi_cache_age', 1.0))
+        self.timing_reporter.add_source('roi_cache', self.roi_cache.stats)
         self.state = TrafficLight.UNKNOWN
-        self.last_state = TrafficLight.UNKNOWN
-        self.last_wp = -1
-        self.state_count = 0
 
-        self.closest_waypoint = 0
+        # Frames are classified in a background thread, always the newest one.
+        self.last_detection = None
+        self.frame_worker = LatestFrameWorker(self.process_image, rospy.logerr)
+        self.timing_reporter.add_source('frame_worker', self.frame_worker.stats)
+
+        # With ~classifier_workers > 0 the ROIs are classified in worker
+        # processes and the results are published by a collector thread.
+        self.classifier_pool = None
+        workers = rospy.get_param('~classifier_workers', 0)
+        if workers > 0 and self.is_site:
+            rospy.logwarn('classifier_workers is not used in site mode')
+        elif workers > 0:
+            self.classifier_pool = ClassifierPool(
+                workers, use_cascade=self.light_classifier.cascade is not None,
+                model_path=self.light_classifier.model_path)
+            rospy.on_shutdown(self.classifier_pool.close)
+            self.timing_reporter.add_source('classifier_pool', self.classifier_pool.stats)
+            self.collector = threading.Thread(target=self.collect_results)
+            self.collector.daemon = True
+            self.collector.start()
+        elif self.light_classifier.cascade is not None:
+            # In the pool the cascade runs in the workers, whose counters are not collected.
+            self.timing_reporter.add_source('color_cascade', self.light_classifier.cascade.stats)
 
-        self.IGNORE_DISTANCE_LIGHT = 90.0
-        self.old_stop_line_pos_wp = []
-        self.last_car_position = 0
+        # provides an image stream from the car's camera. These images are used to determine the color of upcoming traffic lights.
+        sub6 = rospy.Subscriber('/image_color', Image, self.image_cb)
         rospy.spin()
 
     def pose_cb(self, msg):
         self.pose = msg
+        stamp = msg.header.stamp if not msg.header.stamp.is_zero() else rospy.Time.now()
+        self.pose_history.add(stamp, msg.pose)
+
+    def camera_info_cb(self, msg):
+        self.camera.set_camera_info(msg)
 
     def waypoints_cb(self, waypoints):
         self.waypoints = waypoints.waypoints
+        self.wp_index = WaypointIndex.from_waypoints(self.waypoints)
+
+        # Persist the stop line mapping next to the map loaded by waypoint_loader.
+        map_path = rospy.get_param('/waypoint_loader/path', None)
+        cache_path = None if map_path is None else map_path + '.stop_lines.yaml'
+        self.stop_line_map = StopLineMap(self.wp_index, self.config['stop_line_positions'],
+                                         cache_path)
+        self.update_light_map(self.lights)
 
     def traffic_cb(self, msg):
+        self.update_light_map(msg.lights)
         self.lights = msg.lights
 
+    def update_light_map(self, lights):
+        """ Look up the stop-line waypoint of every light.
+        """
+        if self.stop_line_map is None or not lights:
+            return
+        light_xy = [(l.pose.pose.position.x, l.pose.pose.position.y) for l in lights]
+        light_stop_wps = self.stop_line_map.map_lights(light_xy)
+        if self.light_stop_wps is None or not np.array_equal(light_stop_wps, self.light_stop_wps):
+            order = np.argsort(light_stop_wps, kind='mergesort')
+            self.light_order = order.tolist()
+            self.light_order_wps = light_stop_wps[order].tolist()
+        self.light_stop_wps = light_stop_wps
+
     def image_cb(self, msg):
+        """Hands the camera image to the classification worker.
+
+        Args:
+            msg (Image): image from car-mounted camera
+
+        """
+        # The simulator bridge does not stamp images, use the arrival time.
+        stamp = msg.header.stamp if not msg.header.stamp.is_zero() else rospy.Time.now()
+        self.frame_worker.submit((msg, stamp))
+
+    def process_image(self, frame):
         """Identifies red lights in the incoming camera image and publishes the index
             of the waypoint closest to the red light's stop line to /traffic_waypoint
 
+        Runs in the worker thread.
+
         Args:
-            msg (Image): image from car-mounted camera
+            frame (Image, Time): image from car-mounted camera and its stamp
+
+        """
+        msg, stamp = frame
+        with self.timings.timer('process_image'):
+            self.camera_image = msg
+            self.frames += 1
+            # The frame counts as saved once, every decoded ROI is taken off again.
+            self.bytes_saved += msg.height * msg.step
+            if self.is_site:
+                light_wp, probabilities = self.process_site_frame(stamp)
+                self.update_state(light_wp, probabilities, stamp)
+            elif self.classifier_pool is None:
+                light_wp, probabilities = self.process_traffic_lights(stamp)
+                self.update_state(light_wp, probabilities, stamp)
+            else:
+                lights, light_wps, boxes = self.find_lights(stamp)
+                rois = []
+                signatures = []
+                cached = []
+                for light, box in zip(lights, boxes if lights else []):
+                    roi = self.get_light_roi(box)
+                    probabilities, signature = self.roi_cache.lookup(light, roi, stamp.to_sec())
+                    # A cached light is not classified again.
+                    rois.append(roi if probabilities is None else None)
+                    signatures.append(signature)
+                    cached.append(probabilities)
+                # The frame goes through the pool even with nothing to
+                # classify, to keep its place in the order.
+                self.classifier_pool.submit(rois, (lights, light_wps, stamp, signatures, cached))
+
+    def collect_results(self):
+        """ Publishes the pool's results in frame order. Runs in its own thread.
+        """
+        while not rospy.is_shutdown():
+            for meta, probabilities, elapsed in self.classifier_pool.get_results(0.5):
+                # A failing result is logged, the thread keeps publishing.
+                try:
+                    self.publish_result(meta, probabilities, elapsed)
+                except Exception:
+                    rospy.logerr(traceback.format_exc())
+
+    def publish_result(self, meta, probabilities, elapsed):
+        """ Caches and publishes the result of one frame of the pool.
 
+        Args:
+            meta (tuple): light indices, light waypoints, stamp, signatures and
+                          cached probabilities given to the pool with the ROIs
+            probabilities (list): classifier probabilities of each light, None
+                                  if not classified
+            elapsed (double): seconds the workers spent classifying the ROIs
         """
-        #rospy.loginfo('image_cb')
-        start_time = time.time()
+        lights, light_wps, stamp, signatures, cached = meta
+        if not lights:
+            self.update_state(-1, None, stamp)
+            return
+        classified = 0
+        probabilities = list(probabilities)
+        for i, light in enumerate(lights):
+            if cached[i] is not None:
+                probabilities[i] = cached[i]
+            elif probabilities[i] is not None:
+                classified += 1
+                self.roi_cache.store(light, signatures[i], probabilities[i], stamp.to_sec())
+        if classified:
+            self.roi_cache.record_cost(elapsed, classified)
+        light_wp, p = self.closest_known_light(light_wps, probabilities)
+        self.update_state(light_wp, p, stamp)
+
+    def update_state(self, light_wp, probabilities, stamp):
+        """ Filters the detected light state and publishes /traffic_waypoint.
+
+        Args:
+            light_wp (int): waypoint of the light's stop line (-1 if none)
+            probabilities (ndarray): classifier probabilities of the light, None if none
+            stamp (Time): stamp of the frame the state was detected in
 
-        self.has_image = True
-        self.camera_image = msg
-        light_wp, state = self.process_traffic_lights()
-        rospy.loginfo('tl state = ' + str(state))
+        """
+        # A different light comes into view, its state is not known yet.
+        if light_wp != self.filter_wp:
+            self.light_filter.reset()
+            self.filter_wp = light_wp
+
+        observation = self.light_filter.observation(self.light_classifier.light_states,
+                                                    probabilities)
+        state = self.light_filter.update(observation)
+        if state != self.state:
+            rospy.loginfo('tl state = ' + str(state))
+        self.state = state
 
         '''
         Publish upcoming red lights at camera frequency.
-        Each predicted state has to occur `STATE_COUNT_THRESHOLD` number
-        of times till we start using it. Otherwise the previous stable state is
-        used.
         '''
-        if self.state != state:
-            self.state_count = 0
-            self.state = state
-        elif self.state_count >= STATE_COUNT_THRESHOLD:
-            self.last_state = self.state
-            light_wp = light_wp if state == TrafficLight.RED else -1
-            self.last_wp = light_wp
-            self.upcoming_red_light_pub.publish(Int32(light_wp))
-        else:
-            self.upcoming_red_light_pub.publish(Int32(self.last_wp))
-        self.state_count += 1
-        
-        elapsed_time = time.time() - start_time
-        rospy.loginfo('image_cb time = %0.1fus\n' % (1000.0*1000*elapsed_time))
-
+        light_wp = light_wp if state == TrafficLight.RED else -1
+        self.upcoming_red_light_pub.publish(Int32(light_wp))
+
+        self.last_detection = Detection(light_wp, state, stamp)
+        # End-to-end age of the frame when its result was published.
+        self.timings.timer('frame_age').record((rospy.Time.now() - stamp).to_sec())
+
+    def image_gate_summary(self):
+        summary = {
+            "frames": self.frames,
+            "skipped": self.frames_skipped,
+            "bytes_saved": self.bytes_saved
+        }
+        # Stamp of the frame behind the last published state, and its age now.
+        detection = self.last_detection
+        if detection is not None:
+            summary["last_detection_state"] = detection.state
+            summary["last_detection_stamp"] = detection.stamp.to_sec()
+            summary["last_detection_age_s"] = (rospy.Time.now() - detection.stamp).to_sec()
+        return summary
 
     def get_closest_waypoint(self, pose):
         """Identifies the closest path waypoint to the given position
-            https://en.wikipedia.org/wiki/Closest_pair_of_points_problem
+
         Args:
             pose (Pose): position to match a waypoint to
         Returns:
             int: index of the closest waypoint in self.waypoints
         """
-        
-        pos = pose.position
-        l_id = 0
-        r_id = len(self.waypoints) - 1
-        m_id = len(self.waypoints)-1
-
-        while l_id < r_id:
-            ldist = self.pos_distance(self.waypoints[l_id].pose.pose.position, pos)
-            rdist = self.pos_distance(self.waypoints[r_id].pose.pose.position, pos)
-            xmid = (l_id + r_id) // 2
-            mdist = self.pos_distance(self.waypoints[xmid].pose.pose.position, pos)
-
-            closest_dist = ldist
-            m_id = l_id
-            if mdist < closest_dist:
-                closest_dist = mdist
-                m_id = xmid
-            if rdist < closest_dist:
-                closest_dist = rdist
-                m_id = r_id
-
-            # If l_id is right before xmid and xmid is right before r_id,
-            # then xmid is the closest waypoint
-            if l_id == xmid -1 and xmid == r_id -1:
-                break
-
-            # c: car
-            # l: left point
-            # r: right point
-            # m: xmid
-            # *: closest waypoint
-            if rdist < mdist:
-                if ldist < rdist:
-                    # l--c----r--m
-                    r_id = xmid - 1
-                else:
-                    # l----c--r--m
-                    l_id = xmid + 1
-
-            elif mdist < closest_dist:
-                # l--c--m--*--r
-                l_id = xmid-1
-            elif mdist > closest_dist :
-                # l--c--*--m--r
-                r_id = xmid+1
-
-            elif mdist == closest_dist:
-                # ?-cm-?
-                if ldist < rdist:
-                    # l--cm---r
-                    r_id = xmid + (r_id - xmid) // 2
-                elif rdist < ldist:
-                    # l---cm--r
-                    l_id = xmid - (xmid - l_id) // 2
-
-        return m_id
+        return self.wp_index.closest_to_pose(pose)
 
     def pos_distance(self, a, b):
         """ Distance between two positions
         """
         return math.sqrt((a.x-b.x)**2 + (a.y-b.y)**2 + (a.z-b.z)**2)
 
-    def distance_2d(self, a, b):
-        return math.sqrt((a.x-b.x)**2 + (a.y-b.y)**2)
+    def get_light_states(self, lights, boxes, stamp):
+        """Determines the current color of the traffic lights
 
-    def project_to_image_plane(self, point_in_world):
-        """Project point from 3D world coordinates to 2D camera image location
+        Lights whose crop did not change since they were last classified
+        reuse that result, the others are classified in one call of the
+        classifier.
 
         Args:
-            point_in_world (Point): 3D location of a point in the world
+            lights (list): index of each light in self.lights, the cache key
+            boxes (ndarray): (top, left, bottom, right) of each light in the image
+            stamp (Time): time the camera image was taken
 
         Returns:
-            x (int): x coordinate of target point in image
-            y (int): y coordinate of target point in image
+            list: ID of traffic light color of each light (specified in styx_msgs/TrafficLight)
+            list: classifier probabilities of each light
 
         """
+        now = stamp.to_sec()
+        cropped_images = [self.get_light_roi(box) for box in boxes]
+        probabilities = []
+        signatures = []
+        for light, image in zip(lights, cropped_images):
+            cached, signature = self.roi_cache.lookup(light, image, now)
+            probabilities.append(cached)
+            signatures.append(signature)
 
+        #Get classification
+        misses = [i for i, p in enumerate(probabilities) if p is None]
+        if misses:
+            start_time = time.time()
+            with self.timings.timer('classify'):
+                _, classified = self.light_classifier.get_classifications(
+                    [cropped_images[i] for i in misses])
+            self.roi_cache.record_cost(time.time() - start_time, len(misses))
+            for i, p in zip(misses, classified):
+                probabilities[i] = p
+                self.roi_cache.store(lights[i], signatures[i], p, now)
+
+        states = [self.light_classifier.state_from_probabilities(p) for p in probabilities]
+        #rospy.loginfo(states)
+
+        return states, probabilities
 
-        # From udacity.
-        fx = 2574
-        fy = 2744
-        image_width = self.config['camera_info']['image_width']
-        image_height = self.config['camera_info']['image_height']
-
-        trans = None
-
-        try:
-            now = rospy.Time.now()
-            self.listener.waitForTransform("/base_link",
-                  "/world", now, rospy.Duration(1.0))
-            (trans, rot) = self.listener.lookupTransform("/base_link",
-                  "/world", now)
-
-        except (tf.Exception, tf.LookupException, tf.ConnectivityException):
-            rospy.logerr("Failed to find camera to map transform")
-
-        # Use tranform and rotation to calculate 2D position of light in image
-        if (trans != None):
-            # Convert rotation vector so we can use it.
-            yaw = tf.transformations.euler_from_quaternion(rot)[2]
-
-            # Rotation followed by translation
-            px = point_in_world.x
-            py = point_in_world.y
-            pz = point_in_world.z
-            xt = trans[0]
-            yt = trans[1]
-            zt = trans[2]
-
-            Rnt = (
-                px * math.cos(yaw) - py * math.sin(yaw) + xt,
-                px * math.sin(yaw) + py * math.cos(yaw) + yt,
-                pz + zt)
-
-            u = int(fx * -Rnt[1] / Rnt[0] + image_width / 2 - 30)
-            v = int(fy * -(Rnt[2] - 1.0) / Rnt[0] + image_height + 50)
-
-            light_width = 1.0
-            light_height = 1.95
-
-            distance = self.distance_2d(self.pose.pose.position, point_in_world)
-
-            # Size of traffic light within 2D picture
-            light_width_estimate = 2 * fx * math.atan(light_width / (2 * distance))
-            light_height_estimate = 2 * fx * math.atan(light_height / (2 * distance))
-            # Get points for traffic light's bounding box
-            bbox_topleft = (int(u - light_width_estimate / 2), int(v - light_height_estimate / 2))
-            bbox_bottomright = (int(u + light_width_estimate / 2), int(v + light_height_estimate / 2))
-        else:
-            # No translation matrix so we cannot find the light.
-            bbox_topleft = (0, 0)
-            bbox_bottomright = (0, 0)
-
-        return (bbox_topleft, bbox_bottomright)
-
-
-    def resize_image(self, img, width, height):
-        
-        aspect_ratio_width = 0.5
-        aspect_ratio_height = height/width
-        img_height, img_width = img.shape[:2]
-        crop_height = int(img_width / aspect_ratio_width)
-        extra_height = (img_height - crop_height) / 2
-        crop_width = int(img_height / aspect_ratio_height)
-        extra_width = (img_width - crop_width) / 2
-        # Crop image to keep aspect ratio
-        if extra_height > 0:
-            crop_img = img[int(extra_height):int(img_height-math.ceil(extra_height)), 0:int(img_width)]
-        elif extra_width > 0:
-            crop_img = img[0:int(img_height), int(extra_width):int(img_width-math.ceil(extra_width))]
-        else:
-            crop_img = img
-
-        return cv2.resize(crop_img, (width, height), 0, 0, interpolation=cv2.INTER_AREA)
-
-    def get_light_state(self, light):
-        """Determines the current color of the traffic light
+    def get_light_roi(self, box):
+        """Crops the traffic light out of the current camera image
 
         Args:
-            light (TrafficLight): light to classify
+            box (ndarray): (top, left, bottom, right) of the light in the image
 
         Returns:
-            int: ID of traffic light color (specified in styx_msgs/TrafficLight)
+            ndarray: BGR image of the light, resized for the classifier (empty
+                     if the light is outside the image)
 
         """
-        if(not self.has_image):
-            self.prev_light_loc = None
-            return False
+        image = self.camera_image
 
-        cv_image = self.bridge.imgmsg_to_cv2(self.camera_image, "bgr8")
-
-        pt = Point()
-        pt.x = light.pose.pose.position.x
-        pt.y = light.pose.pose.position.y
-        pt.z = 0
-        
-        # Convert given traffic light coordinates into position within 2D image
-        tleft, bright = self.project_to_image_plane(light.pose.pose.position)
-        cropped_image = cv_image[tleft[1]:bright[1], tleft[0]:bright[0]]
+        # Only the light's rows and columns are decoded from the message.
+        cropped_image = decode_roi(image, *box)
+        self.bytes_saved -= cropped_image.nbytes
 
         if (cropped_image.shape[0] > 0 and cropped_image.shape[1] > 0):
-            cropped_image = self.resize_image(cropped_image, 30, 60)
-
-        #Get classification
-        clazz = self.light_classifier.get_classification(cropped_image)
-        #rospy.loginfo(clazz)
-
-        return clazz
+            cropped_image = resize_image(cropped_image, 30, 60)
+        return cropped_image
 
-    def process_traffic_lights(self):
+    def process_traffic_lights(self, stamp):
         """Finds closest visible traffic light, if one exists, and determines its
             location and color
+
+        All visible lights are classified; the closest one whose color could
+        be recognized is reported.
+
+        Args:
+            stamp (Time): time the camera image was taken
+
         Returns:
             int: index of waypoint closes to the upcoming stop line for a traffic light (-1 if none exists)
-            int: ID of traffic light color (specified in styx_msgs/TrafficLight)
+            ndarray: classifier probabilities of the light, None if none exists
+        """
+        lights, light_wps, boxes = self.find_lights(stamp)
+        if not lights:
+            return -1, None
+        _, probabilities = self.get_light_states(lights, boxes, stamp)
+        return self.closest_known_light(light_wps, probabilities)
+
+    def closest_known_light(self, light_wps, probabilities):
+        """Picks the closest light whose color could be recognized, else the closest one
+
+        Args:
+            light_wps (list): stop-line waypoint of each light, closest first
+            probabilities (list): classifier probabilities of each light, None if not classified
+
+        Returns:
+            int: stop-line waypoint of the picked light
+            ndarray: classifier probabilities of the picked light
+        """
+        for light_wp, p in zip(light_wps, probabilities):
+            if p is not None and \
+                    self.light_classifier.state_from_probabilities(p) != TrafficLight.UNKNOWN:
+                return light_wp, p
+        return light_wps[0], probabilities[0]
+
+    def process_site_frame(self, stamp):
+        """Finds traffic lights in the whole camera image and determines their color
+
+        Used at the site, where the light poses are not known. The lights are
+        taken to belong to the next stop line ahead of the car.
+
+        Args:
+            stamp (Time): time the camera image was taken
+
+        Returns:
+            int: index of waypoint closest to the next stop line (-1 if none within LIGHT_HORIZON)
+            ndarray: classifier probabilities of the light, None if none was found
+        """
+        car = self.pose_history.lookup(stamp)
+        light_wp = -1 if car is None else self.next_stop_line(car)
+        if light_wp < 0:
+            # No stop line ahead: the image is not touched.
+            self.frames_skipped += 1
+            return -1, None
+
+        image = self.camera_image
+        frame = decode_roi(image, 0, 0, image.height, image.width)
+        self.bytes_saved -= frame.nbytes
+        with self.timings.timer('propose'):
+            boxes = self.light_proposer.propose(frame)
+        if len(boxes) == 0:
+            return light_wp, None
+
+        crops = [resize_image(frame[top:bottom, left:right], 30, 60)
+                 for top, left, bottom, right in boxes]
+        with self.timings.timer('classify'):
+            states, probabilities = self.light_classifier.get_classifications(crops)
+        # Any red candidate wins, otherwise the most confident one.
+        if TrafficLight.RED in states:
+            return light_wp, probabilities[states.index(TrafficLight.RED)]
+        return light_wp, probabilities[int(np.argmax(np.max(probabilities, axis=1)))]
+
+    def next_stop_line(self, car):
+        """ Get the next stop line ahead of the car within LIGHT_HORIZON.
+
+        Args:
+            car (tuple): (x, y, z, yaw) pose of the car.
+        Returns:
+            int: Waypoint of the stop line, -1 if there is none.
+        """
+        if self.stop_line_map is None:
+            return -1
+        car_wp = self.wp_index.closest(car[0], car[1])
+        stop_wps = self.stop_line_map.stop_line_wps
+        dist = self.wp_index.arc_distance(car_wp, stop_wps)
+        ahead = (dist >= 0) & (dist <= LIGHT_HORIZON)
+        if not ahead.any():
+            return -1
+        return int(stop_wps[ahead][np.argmin(dist[ahead])])
+
+    def find_lights(self, stamp):
+        """Finds the visible traffic lights ahead, closest first
+
+        Args:
+            stamp (Time): time the camera image was taken
+
+        Returns:
+            list: index of each light in self.lights
+            list: index of waypoint closest to the stop line of each light
+            ndarray: (top, left, bottom, right) of each light in the image
         """
-        light = None
         #rospy.loginfo('self.waypoints = ' + str(self.waypoints))
 
         if self.waypoints is None:
           rospy.logerr('self.waypoints is None')
 
-        if self.waypoints is not None:
-            # List of positions that correspond to the line to stop in front of for a given intersection
-            stop_line_positions = self.config['stop_line_positions']
-            if(self.pose):
-                car_position = self.get_closest_waypoint(self.pose.pose)
-
-            #find the closest visible traffic light (if one exists)
-            light = self.get_closest_light(self.pose.pose)
-
-            if light:
-                light_wp = self.get_closest_waypoint(light.pose.pose)
-                state = self.get_light_state(light)
-
-                # Debugging traffic light:
-                #
-                # rospy.loginfo("light_xyz: ({}, {}, {}), wp_xyz({}): ({}, {}, {})".format(
-                #     light.pose.pose.position.x,
-                #     light.pose.pose.position.y,
-                #     light.pose.pose.position.z,
-                #     light_wp,
-                #     self.waypoints[light_wp].pose.pose.position.x,
-                #     self.waypoints[light_wp].pose.pose.position.y,
-                #     self.waypoints[light_wp].pose.pose.position.z
-                # ))
-                return light_wp, state
+        # Pose of the car when the image was taken.
+        car = self.pose_history.lookup(stamp)
+        if self.waypoints is not None and car is not None and self.light_stop_wps is not None:
+            car_position = self.wp_index.closest(car[0], car[1])
+
+            #find the visible traffic lights (if any)
+            light_idx, boxes = self.get_visible_lights(car, car_position)
+
+            if light_idx:
+                # Waypoints of the stop lines in front of the lights.
+                return light_idx, [int(self.light_stop_wps[i]) for i in light_idx], boxes
             #self.waypoints = None
-        return -1, TrafficLight.UNKNOWN
 
-    def get_closest_light(self, pose):
-        """ Get the position of the closest traffic light.
+        # No light ahead: the image is not touched.
+        if self.camera_image is not None:
+            self.frames_skipped += 1
+        return [], [], None
+
+    def get_visible_lights(self, car, car_wp):
+        """ Get the next traffic lights ahead of the car that the camera can see.
+
+        Lights are ordered by their stop-line waypoint, so the next ones along
+        the track are found with a binary search from the car's waypoint. They
+        are then all projected into the image at once.
 
         Args:
-            pose (Pose): Position of car.
+            car (tuple): (x, y, z, yaw) pose of the car.
+            car_wp (int): Waypoint of the car.
         Returns:
-            TrafficLight: light object.
+            list: Indices in self.lights of the visible lights, closest first.
+            ndarray: (top, left, bottom, right) of each of them in the image.
         """
-        # Decide if we should have a horizon (a max distance at which the car will try and capture the light).
-        horizon = 100
-
-        min_dist = float("inf")
-        light = None
-        #rospy.loginfo('self.lights = ' + str(self.lights))
-
-        for l in self.lights:
-            dist = self.pos_distance(pose.position, l.pose.pose.position)
-            if dist < min_dist and dist < horizon:
-                min_dist = dist
-                light = l
-        return light
+        order = self.light_order
+        order_wps = self.light_order_wps
+        if not order:
+            return [], None
+
+        first = bisect.bisect_left(order_wps, car_wp)
+        candidates = []
+        for k in range(min(LIGHT_CANDIDATES, len(order))):
+            pos = (first + k) % len(order)
+            if not self.wp_index.is_loop and pos < first:
+                break
+            if self.wp_index.arc_distance(car_wp, order_wps[pos]) > LIGHT_HORIZON:
+                break
+            candidates.append(order[pos])
+        if not candidates:
+            return [], None
+
+        light_xyz = np.array([(self.lights[i].pose.pose.position.x,
+                               self.lights[i].pose.pose.position.y,
+                               self.lights[i].pose.pose.position.z) for i in candidates])
+        boxes, visible = self.camera.light_boxes(car, light_xyz)
+        return [i for i, v in zip(candidates, visible) if v], boxes[visible]
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import csv
+import time
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from helpers import distance
+from waypoint_index import WaypointIndex
+
+'''
+Microbenchmark of the closest-waypoint lookup, run without ROS:
+
+    python bench_closest_waypoint.py --queries 2000
+
+Compares the heuristic binary search the nodes used before against
+`WaypointIndex` (single and batched queries) on `data/sim_waypoints.csv`,
+and reports how often each one disagrees with a brute-force search.
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+default_path = os.path.join(dir_path, "..", "..", "..", "data", "sim_waypoints.csv")
+
+Point = namedtuple('Point', 'x y z')
+
+
+def load_positions(path):
+    positions = []
+    with open(path) as wfile:
+        for row in csv.reader(wfile):
+            positions.append(Point(float(row[0]), float(row[1]), float(row[2])))
+    return positions
+
+
+def legacy_closest_waypoint(positions, pos):
+    """ The search `get_closest_waypoint` used before the KD-tree index.
+    """
+    l_id = 0
+    r_id = len(positions) - 1
+    m_id = len(positions)-1
+
+    while l_id < r_id:
+        ldist = distance(positions[l_id], pos)
+        rdist = distance(positions[r_id], pos)
+        xmid = (l_id + r_id) // 2
+        mdist = distance(positions[xmid], pos)
+
+        closest_dist = ldist
+        m_id = l_id
+        if mdist < closest_dist:
+            closest_dist = mdist
+            m_id = xmid
+        if rdist < closest_dist:
+            closest_dist = rdist
+            m_id = r_id
+
+        if l_id == xmid -1 and xmid == r_id -1:
+            break
+
+        if rdist < mdist:
+            if ldist < rdist:
+                r_id = xmid - 1
+            else:
+                l_id = xmid + 1
+        elif mdist < closest_dist:
+            l_id = xmid-1
+        elif mdist > closest_dist:
+            r_id = xmid+1
+        elif mdist == closest_dist:
+            if ldist < rdist:
+                r_id = xmid + (r_id - xmid) // 2
+            elif rdist < ldist:
+                l_id = xmid - (xmid - l_id) // 2
+            else:
+                # The node version loops forever here.
+                break
+
+    return m_id
+
+
+def timed(fn, *args):
+    start_time = time.time()
+    result = fn(*args)
+    return result, time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closest waypoint microbenchmark')
+    parser.add_argument('--path', default=default_path, help='waypoint csv file')
+    parser.add_argument('--queries', type=int, default=2000, help='number of query poses')
+    parser.add_argument('--noise', type=float, default=2.0, help='pose noise around the track (m)')
+    args = parser.parse_args()
+
+    positions = load_positions(args.path)
+    xy = np.array([(p.x, p.y) for p in positions])
+
+    rng = np.random.RandomState(0)
+    picks = rng.randint(0, len(xy), args.queries)
+    queries = xy[picks] + rng.normal(scale=args.noise, size=(args.queries, 2))
+    query_points = [Point(qx, qy, 0.0) for qx, qy in queries]
+
+    # Ground truth.
+    truth = np.array([np.argmin(((xy - q) ** 2).sum(axis=1)) for q in queries])
+
+    index, build_time = timed(WaypointIndex, xy)
+
+    legacy, legacy_time = timed(
+        lambda: [legacy_closest_waypoint(positions, p) for p in query_points])
+    single, single_time = timed(
+        lambda: [index.closest(q[0], q[1]) for q in queries])
+    (_, batch), batch_time = timed(index.closest_batch, queries)
+
+    print("waypoints: {}, queries: {}".format(len(xy), args.queries))
+    print("index build: {:.1f}ms".format(1000.0 * build_time))
+    for name, result, elapsed in [("legacy search", legacy, legacy_time),
+                                  ("kd-tree single", single, single_time),
+                                  ("kd-tree batch", batch, batch_time)]:
+        wrong = int(np.sum(np.asarray(result) != truth))
+        print("{:<15} {:8.2f}us/query  wrong: {}".format(
+            name, 1e6 * elapsed / args.queries, wrong))
+
+
+if __name__ == '__main__':
+    main()
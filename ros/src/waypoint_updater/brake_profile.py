@@ -0,0 +1,101 @@
+import numpy as np
+
+'''
+Jerk-limited stop profiles for waypoint_updater.
+
+A stop profile gives the target speed of every waypoint behind a stop line so
+that the car comes to rest at the line without exceeding the deceleration and
+jerk limits. Profiles only depend on the track geometry, the stop waypoint and
+the cruise speed, so they are computed once per stop line and cached; frames
+close to the same light just slice the cached arrays.
+'''
+
+
+def stop_curve(v_cruise, decel, jerk, num=200):
+    """ Speed as a function of the distance left to a stop.
+
+    The deceleration ramps up at `jerk`, holds at `decel` (or less if the
+    cruise speed is too low to reach it) and ramps down to zero at the stop,
+    so the car is never jerked at either end of the braking.
+
+    Args:
+        v_cruise (double): Speed (m/s) before braking.
+        decel (double): Maximum deceleration magnitude (m/s^2).
+        jerk (double): Maximum jerk magnitude (m/s^3).
+        num (int): Number of samples of the curve.
+
+    Returns:
+        (ndarray, ndarray): Distances to the stop (increasing, m) and the
+                            speed at each of them.
+    """
+    if v_cruise <= 0.0:
+        return np.zeros(1), np.zeros(1)
+
+    # Work backwards in time from the stop, t is the time left until the stop.
+    a_peak = min(decel, np.sqrt(v_cruise * jerk))
+    t_ramp = a_peak / jerk
+    v_ramp = a_peak * t_ramp / 2.0
+    t_hold = (v_cruise - 2.0 * v_ramp) / a_peak
+    t_total = 2.0 * t_ramp + t_hold
+
+    t = np.linspace(0.0, t_total, num)
+    v = np.empty(num)
+    d = np.empty(num)
+
+    d_ramp = jerk * t_ramp ** 3 / 6.0
+    v_hold_end = v_ramp + a_peak * t_hold
+    d_hold_end = d_ramp + v_ramp * t_hold + a_peak * t_hold ** 2 / 2.0
+
+    ramp = t < t_ramp
+    hold = (t >= t_ramp) & (t < t_ramp + t_hold)
+    last = t >= t_ramp + t_hold
+
+    u = t[ramp]
+    v[ramp] = jerk * u ** 2 / 2.0
+    d[ramp] = jerk * u ** 3 / 6.0
+
+    u = t[hold] - t_ramp
+    v[hold] = v_ramp + a_peak * u
+    d[hold] = d_ramp + v_ramp * u + a_peak * u ** 2 / 2.0
+
+    u = t[last] - t_ramp - t_hold
+    v[last] = v_hold_end + a_peak * u - jerk * u ** 2 / 2.0
+    d[last] = d_hold_end + v_hold_end * u + a_peak * u ** 2 / 2.0 - jerk * u ** 3 / 6.0
+
+    return d, v
+
+
+class BrakeProfiler(object):
+    def __init__(self, index, decel, jerk):
+        """
+        Args:
+            index (WaypointIndex): Index of the track waypoints.
+            decel (double): Deceleration magnitude (m/s^2) used for planned stops.
+            jerk (double): Jerk limit (m/s^3).
+        """
+        self.index = index
+        self.decel = decel
+        self.jerk = jerk
+        self.cache = {}
+
+    def stop_profile(self, stop_wp, v_cruise):
+        """ Get the braking waypoints and their speeds for a stop at `stop_wp`.
+
+        Returns:
+            (ndarray, ndarray): Waypoint ids in driving order, the last one being
+                                `stop_wp`, and the speed at each of them.
+        """
+        key = (stop_wp, round(v_cruise, 3))
+        profile = self.cache.get(key)
+        if profile is None:
+            d_curve, v_curve = stop_curve(v_cruise, self.decel, self.jerk)
+            start_wp = self.index.wp_at_distance(stop_wp, -d_curve[-1])
+            wps = self.index.wps_between(start_wp, stop_wp)
+            dist = self.index.s[stop_wp] - self.index.s[wps]
+            if self.index.is_loop:
+                dist %= self.index.length
+            speeds = np.interp(dist, d_curve, v_curve, right=v_cruise)
+            speeds.flags.writeable = False
+            profile = (wps, speeds)
+            self.cache[key] = profile
+        return profile
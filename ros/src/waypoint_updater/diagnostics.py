@@ -0,0 +1,54 @@
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+'''
+Periodic publishing of a node's timing statistics on /diagnostics.
+
+Timing can be switched on and off at runtime with the node's private
+`timing_enabled` parameter, e.g.
+
+    rosparam set /waypoint_updater/timing_enabled false
+'''
+
+
+class TimingReporter(object):
+    def __init__(self, timings, period=5.0):
+        """
+        Args:
+            timings (Timings): Timers of the node.
+            period (double): Seconds between two reports.
+        """
+        self.timings = timings
+        self.node_name = rospy.get_name()
+        self.sources = []
+        self.pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+        self.timer = rospy.Timer(rospy.Duration(period), self.report)
+
+    def add_source(self, name, summary_fn):
+        """ Add other statistics to the reports.
+
+        Args:
+            name (str): Name of the statistics.
+            summary_fn (callable): Returns a dict of values, or None to skip.
+        """
+        self.sources.append((name, summary_fn))
+
+    def report(self, event=None):
+        self.timings.set_enabled(rospy.get_param('~timing_enabled', True))
+        if not self.timings.enabled:
+            return
+
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        stats = sorted(self.timings.summaries().items())
+        stats += [(name, fn()) for name, fn in self.sources]
+        for name, summary in stats:
+            if summary is None:
+                continue
+            status = DiagnosticStatus()
+            status.level = DiagnosticStatus.OK
+            status.name = '{}: {}'.format(self.node_name, name)
+            status.hardware_id = self.node_name
+            status.values = [KeyValue(key, str(value)) for key, value in sorted(summary.items())]
+            msg.status.append(status)
+        self.pub.publish(msg)
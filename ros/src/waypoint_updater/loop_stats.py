@@ -0,0 +1,65 @@
+import math
+
+
+class LoopStats(object):
+    """ Timing statistics of a fixed-rate loop.
+
+    Call `start` at the beginning of every cycle and `stop` once its work is
+    done. `summary` then gives the measured period, its jitter (standard
+    deviation of the period) and how many cycles overran the nominal period.
+    Callers add the number of messages folded into each cycle to `inputs`.
+    """
+    def __init__(self, rate):
+        """
+        Args:
+            rate (double): Nominal loop rate in Hz.
+        """
+        self.period = 1.0 / rate
+        self.last_start = None
+        self.reset()
+
+    def reset(self):
+        """ Start a new reporting window.
+        """
+        self.cycles = 0
+        self.overruns = 0
+        self.sum_period = 0.0
+        self.sum_period_sq = 0.0
+        self.max_work = 0.0
+        self.inputs = 0
+
+    def start(self, now):
+        if self.last_start is not None:
+            dt = now - self.last_start
+            self.cycles += 1
+            self.sum_period += dt
+            self.sum_period_sq += dt * dt
+        self.last_start = now
+
+    def stop(self, now):
+        work = now - self.last_start
+        if work > self.period:
+            self.overruns += 1
+        if work > self.max_work:
+            self.max_work = work
+
+    def summary(self):
+        """
+        Returns:
+            dict: Mean period, jitter and max work time (all in ms), number of
+                  cycles, overruns and inputs per cycle since the last reset.
+        """
+        if self.cycles == 0:
+            mean = jitter = inputs = 0.0
+        else:
+            mean = self.sum_period / self.cycles
+            jitter = math.sqrt(max(self.sum_period_sq / self.cycles - mean * mean, 0.0))
+            inputs = self.inputs / float(self.cycles)
+        return {
+            "period_ms": 1000.0 * mean,
+            "jitter_ms": 1000.0 * jitter,
+            "max_work_ms": 1000.0 * self.max_work,
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "inputs_per_cycle": inputs
+        }
@@ -0,0 +1,50 @@
+import numpy as np
+
+'''
+Zero-copy access to sensor_msgs/PointCloud2 data as a NumPy structured array.
+'''
+
+# sensor_msgs/PointField datatypes.
+POINT_FIELD_TYPES = {
+    1: 'i1',  # INT8
+    2: 'u1',  # UINT8
+    3: 'i2',  # INT16
+    4: 'u2',  # UINT16
+    5: 'i4',  # INT32
+    6: 'u4',  # UINT32
+    7: 'f4',  # FLOAT32
+    8: 'f8',  # FLOAT64
+}
+
+
+def cloud_dtype(msg):
+    """ Build the structured dtype of one point of a PointCloud2 message.
+    """
+    order = '>' if msg.is_bigendian else '<'
+    names, formats, offsets = [], [], []
+    for field in msg.fields:
+        fmt = order + POINT_FIELD_TYPES[field.datatype]
+        if field.count > 1:
+            fmt = (fmt, field.count)
+        names.append(field.name)
+        formats.append(fmt)
+        offsets.append(field.offset)
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': msg.point_step})
+
+
+def cloud_to_array(msg):
+    """ View the points of a PointCloud2 message as a structured array.
+
+    The array shares memory with `msg.data`, nothing is copied.
+
+    Returns:
+        ndarray: Structured array of shape (height * width,), e.g. `arr['x']`.
+    """
+    dtype = cloud_dtype(msg)
+    if msg.row_step == msg.width * msg.point_step:
+        return np.frombuffer(msg.data, dtype=dtype, count=msg.height * msg.width)
+    # Rows are padded, step over the padding with strides.
+    rows = np.ndarray(shape=(msg.height, msg.width), dtype=dtype, buffer=msg.data,
+                      strides=(msg.row_step, msg.point_step))
+    return rows.reshape(-1)
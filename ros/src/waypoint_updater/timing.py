@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+
+'''
+Low-overhead timing instrumentation shared by the nodes.
+
+Named timers record durations into a fixed-size ring buffer, so recording
+never allocates and never logs. Percentiles are only computed when a summary
+is requested (see diagnostics.TimingReporter). A disabled timer costs a
+single attribute check:
+
+    timings = Timings()
+    with timings.timer('drive'):
+        ...
+'''
+
+
+class Timer(object):
+    def __init__(self, name, size=1024):
+        self.name = name
+        self.enabled = True
+        self.samples = np.zeros(size)
+        self.count = 0
+        self.start_time = 0.0
+
+    def __enter__(self):
+        if self.enabled:
+            self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.record(time.time() - self.start_time)
+        return False
+
+    def record(self, elapsed):
+        """ Record a duration, in seconds.
+        """
+        self.samples[self.count % len(self.samples)] = elapsed
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+    def summary(self):
+        """
+        Returns:
+            dict: Number of samples and p50/p95/p99/max of the samples in the
+                  buffer (in ms), or None if nothing was recorded.
+        """
+        n = min(self.count, len(self.samples))
+        if n == 0:
+            return None
+        data = self.samples[:n]
+        p50, p95, p99 = np.percentile(data, [50, 95, 99])
+        return {
+            "count": self.count,
+            "p50_ms": 1000.0 * float(p50),
+            "p95_ms": 1000.0 * float(p95),
+            "p99_ms": 1000.0 * float(p99),
+            "max_ms": 1000.0 * float(np.max(data))
+        }
+
+
+class Timings(object):
+    """ Registry of the named timers of a node.
+    """
+    def __init__(self, size=1024, enabled=True):
+        self.size = size
+        self.enabled = enabled
+        self.timers = {}
+
+    def timer(self, name):
+        """ Get the timer called `name`, creating it on first use.
+        """
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = Timer(name, self.size)
+            timer.enabled = self.enabled
+            self.timers[name] = timer
+        return timer
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        for timer in self.timers.values():
+            timer.enabled = enabled
+
+    def summaries(self):
+        """
+        Returns:
+            dict: Summary of every timer that has samples, by name.
+        """
+        result = {}
+        for name, timer in self.timers.items():
+            summary = timer.summary()
+            if summary is not None:
+                result[name] = summary
+        return result
@@ -0,0 +1,231 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+'''
+Spatial index over the x/y positions of the base waypoints.
+
+It is built once when `/base_waypoints` arrives and shared by waypoint_updater
+and tl_detector, so both nodes answer "which waypoint is closest to this pose"
+with an exact KD-tree query instead of scanning Waypoint messages.
+
+The index also keeps a cumulative arc-length table (`s[i]` is the distance
+along the track from waypoint 0 to waypoint i), so along-track distances are
+array lookups and "which waypoint is `d` meters ahead" is a binary search.
+'''
+
+# If the last waypoint is closer than this (in meters) to the first one, the
+# track is treated as a loop and distances wrap around.
+MAX_LOOP_GAP = 50.0
+
+
+class WaypointIndex(object):
+    def __init__(self, xy):
+        """
+        Args:
+            xy (array-like): (N, 2) array of waypoint x/y positions, in track order.
+        """
+        self.xy = np.ascontiguousarray(xy, dtype=np.float64)
+        self.tree = cKDTree(self.xy)
+
+        seg = np.sqrt(np.sum(np.diff(self.xy, axis=0) ** 2, axis=1))
+        self.s = np.concatenate(([0.0], np.cumsum(seg)))
+        gap = np.sqrt(np.sum((self.xy[0] - self.xy[-1]) ** 2))
+        self.is_loop = len(self.xy) > 2 and gap < MAX_LOOP_GAP
+        self.length = self.s[-1] + (gap if self.is_loop else 0.0)
+
+    @classmethod
+    def from_waypoints(cls, waypoints):
+        """ Build the index from a list of styx_msgs/Waypoint.
+        """
+        xy = np.empty((len(waypoints), 2), dtype=np.float64)
+        for i, wp in enumerate(waypoints):
+            pos = wp.pose.pose.position
+            xy[i, 0] = pos.x
+            xy[i, 1] = pos.y
+        return cls(xy)
+
+    def __len__(self):
+        return len(self.xy)
+
+    def closest(self, x, y):
+        """ Get the index of the waypoint closest to (x, y).
+
+        Returns:
+            int: Waypoint index.
+        """
+        _, idx = self.tree.query((x, y))
+        return int(idx)
+
+    def closest_to_pose(self, pose):
+        """ Get the index of the waypoint closest to a geometry_msgs/Pose.
+        """
+        return self.closest(pose.position.x, pose.position.y)
+
+    def closest_batch(self, xy):
+        """ Get the closest waypoints for many positions in one call.
+
+        Args:
+            xy (array-like): (M, 2) array of x/y positions.
+
+        Returns:
+            (ndarray, ndarray): Distances and waypoint indices, both of shape (M,).
+        """
+        dist, idx = self.tree.query(np.asarray(xy, dtype=np.float64).reshape(-1, 2))
+        return dist, idx
+
+    def project_batch(self, xy, max_dist=np.inf):
+        """ Map many positions to the track in one call.
+
+        Args:
+            xy (array-like): (M, 2) array of x/y positions.
+            max_dist (double): Positions farther than this (m) from every
+                               waypoint are not mapped, which keeps queries
+                               for far away points cheap.
+
+        Returns:
+            (ndarray, ndarray): Closest waypoint index of each position (-1 if
+                                not mapped) and its lateral offset (m) from the
+                                track, positive to the left of the driving
+                                direction (inf if not mapped).
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        dist, idx = self.tree.query(xy, distance_upper_bound=max_dist)
+        mapped = np.isfinite(dist)
+        lateral = np.full(len(xy), np.inf)
+        idx = np.where(mapped, idx, -1)
+
+        wp = idx[mapped]
+        n = len(self.xy)
+        prv = wp
+        nxt = wp + 1
+        if self.is_loop:
+            nxt %= n
+        else:
+            # The last waypoint uses the direction of the segment before it.
+            end = nxt >= n
+            nxt[end] = n - 1
+            prv = np.where(end, wp - 1, wp)
+        tangent = self.xy[nxt] - self.xy[prv]
+        tangent /= np.maximum(np.sqrt(np.sum(tangent ** 2, axis=1)), 1e-9)[:, None]
+        rel = xy[mapped] - self.xy[wp]
+        lateral[mapped] = tangent[:, 0] * rel[:, 1] - tangent[:, 1] * rel[:, 0]
+        return idx, lateral
+
+    def arc_distance(self, wp1, wp2):
+        """ Distance along the track when driving from wp1 to wp2.
+
+        On a loop this is always >= 0 (wp2 < wp1 means going around).
+        On an open track it is negative when wp2 is behind wp1.
+        """
+        dist = self.s[wp2] - self.s[wp1]
+        if self.is_loop:
+            dist %= self.length
+        return dist
+
+    def signed_arc_distance(self, wp1, wp2):
+        """ Like `arc_distance`, but on a loop a waypoint that is more than
+        half a lap ahead is reported as behind (negative distance).
+        """
+        dist = self.arc_distance(wp1, wp2)
+        if self.is_loop and dist > self.length / 2.0:
+            dist -= self.length
+        return dist
+
+    def wp_at_distance(self, wp, dist):
+        """ Find the waypoint `dist` meters along the track from `wp`.
+
+        Args:
+            wp (int): The beginning waypoint id.
+            dist (double): Distance from wp, negative for waypoints behind it.
+
+        Returns:
+            int: The first waypoint at least `dist` meters away from wp.
+        """
+        n = len(self.s)
+        target = self.s[wp] + dist
+        if self.is_loop:
+            target %= self.length
+        if dist >= 0:
+            idx = int(np.searchsorted(self.s, target, side='left'))
+            if idx >= n:
+                idx = 0 if self.is_loop else n - 1
+        else:
+            idx = int(np.searchsorted(self.s, target, side='right')) - 1
+            if idx < 0:
+                idx = 0
+        return idx
+
+    def wps_between(self, wp1, wp2):
+        """ Waypoint ids from wp1 to wp2 (inclusive) in driving order.
+        """
+        n = len(self.s)
+        count = (wp2 - wp1) % n + 1 if self.is_loop else max(wp2 - wp1 + 1, 0)
+        return (wp1 + np.arange(count)) % n
+
+
+class WaypointTracker(object):
+    """ Keeps track of the car's current waypoint between pose updates.
+
+    The car only moves a few waypoints between two poses, so each update
+    searches a small window around the previous waypoint. A full index query
+    is only made on startup, or when the window search fails (the closest
+    point lies on the window edge or too far from the car, e.g. after the
+    simulator was reset). This keeps the steady-state cost independent of
+    the track length.
+    """
+    def __init__(self, index, behind=5, ahead=40, max_offset=5.0):
+        """
+        Args:
+            index (WaypointIndex): Index of the track waypoints.
+            behind (int): Number of waypoints behind the previous one to search.
+            ahead (int): Number of waypoints ahead of the previous one to search.
+            max_offset (double): Maximum distance (m) between the car and the
+                                 waypoint found in the window.
+        """
+        self.index = index
+        self.offsets = np.arange(-behind, ahead + 1)
+        self.max_offset_sq = max_offset ** 2
+        self.wp = None
+
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def reset(self):
+        """ Forget the previous waypoint, the next update searches globally.
+        """
+        self.wp = None
+
+    def update(self, x, y):
+        """ Get the waypoint closest to (x, y).
+
+        Returns:
+            int: Waypoint index.
+        """
+        if self.wp is not None:
+            n = len(self.index)
+            window = self.wp + self.offsets
+            if self.index.is_loop:
+                window %= n
+            else:
+                np.clip(window, 0, n - 1, out=window)
+            diff = self.index.xy[window]
+            diff -= (x, y)
+            d2 = np.einsum('ij,ij->i', diff, diff)
+            k = int(np.argmin(d2))
+            if 0 < k < len(window) - 1 and d2[k] <= self.max_offset_sq:
+                self.hits += 1
+                self.wp = int(window[k])
+                return self.wp
+            self.misses += 1
+
+        self.fallbacks += 1
+        self.wp = self.index.closest(x, y)
+        return self.wp
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks
+        }
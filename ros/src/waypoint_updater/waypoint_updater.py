@@ -1,16 +1,24 @@
 #!/usr/bin/env python
 
 import rospy
-from geometry_msgs.msg import PoseStamped
+from geometry_msgs.msg import PoseStamped, TwistStamped
+from sensor_msgs.msg import PointCloud2
 from styx_msgs.msg import Lane, Waypoint
 from std_msgs.msg import Int32
 import tf
 
 import math
+import numpy as np
 import PyKDL
 from copy import deepcopy
 
-from helpers import mph2mps, mps2mph, distance
+from helpers import mph2mps, mps2mph
+from waypoint_index import WaypointIndex, WaypointTracker
+from loop_stats import LoopStats
+from timing import Timings
+from diagnostics import TimingReporter
+from brake_profile import BrakeProfiler
+from point_cloud import cloud_to_array
 
 import time
 
@@ -28,31 +36,53 @@ Please note that our simulator also provides the exact location of traffic light
 current status in `/vehicle/traffic_lights` message. You can use this message to build this node
 as well as to verify your TL classifier.
 
-TODO (for Yousuf and Aaron): Stopline location for each traffic light.
+The stop line of each traffic light is mapped to a waypoint once per map by
+tl_detector (see `StopLineMap`); the waypoint of the stop line ahead of a
+red light arrives on /traffic_waypoint.
 '''
 
 # Lookahead is the waypoints directly ahead the car. It is used to
-# keep the car drives inside a lane.
-LOOKAHEAD_WPS = 12
+# keep the car drives inside a lane. It covers LOOKAHEAD_TIME seconds
+# of driving at the current speed, within LOOKAHEAD_MIN..LOOKAHEAD_MAX
+# meters.
+LOOKAHEAD_TIME = 1.5
+LOOKAHEAD_MIN = 6.0
+LOOKAHEAD_MAX = 40.0
 
 # How far (in number of waypoints) the car may notice a traffic light and/or obstacle.
 LINE_OF_SIGHT_WPS = 80
 
+# Obstacle points closer than this (in meters) to the track center block the lane.
+OBSTACLE_HALF_WIDTH = 2.0
+
 class WaypointUpdater(object):
     def __init__(self):
         rospy.init_node('waypoint_updater')
 
-        rospy.Subscriber('/current_pose', PoseStamped, self.pose_cb)
-        rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
-        rospy.Subscriber('/traffic_waypoint', Int32, self.traffic_cb)
+        # Callback timings, published on /diagnostics.
+        self.timings = Timings()
 
         self.final_waypoints_pub = rospy.Publisher('/final_waypoints', Lane, queue_size=1)
+        self.obstacle_waypoint_pub = rospy.Publisher('/obstacle_waypoint', Int32, queue_size=1)
 
         self.waypoints = None
         self.waypoints_header = None
+        self.wp_index = None
+        self.wp_tracker = None
+        self.brake_profiler = None
 
+        # Target speed of every base waypoint. The Waypoint messages in
+        # self.waypoints are never modified, speeds of a plan are written
+        # into the published copies only.
+        self.target_v = None
+
+        # Latest message from /traffic_waypoint, -1 if there is no red light.
+        self.tl_wp = -1
         self.redlight_wp = None
 
+        # First waypoint ahead of the car blocked by an obstacle, -1 if none.
+        self.obstacle_wp = -1
+
         # To avoid publishing same points multiple times.
         self.published_wp = None
 
@@ -65,6 +95,19 @@ class WaypointUpdater(object):
 
         # Current car's pose.
         self.cur_pose = None
+        self.pose = None
+
+        # Current car's speed (m/s).
+        self.cur_v = 0.0
+
+        # The published Lane and its waypoints are reused every cycle,
+        # lane_pool grows only when the lookahead needs more waypoints.
+        self.lane = Lane()
+        self.lane.header.frame_id = '/world'
+        self.lane_pool = []
+
+        # Number of poses received since the last plan.
+        self.poses_received = 0
 
         self.yaw = 0
 
@@ -74,15 +117,17 @@ class WaypointUpdater(object):
         }
 
         self.tl_config = {
-            # How far (in meters) before traffic light should we stop?
-            # This value can be found by enabling the log that starts with
-            # "redlight_visible" below and then manually drive the car
-            # while monitoring the value of `rl`
-            "offset": 28.28,
+            # How far (in meters) before the stop line should we stop?
+            # /traffic_waypoint is the stop line waypoint, and the car's
+            # pose is its center, so this keeps the front behind the line.
+            "offset": 3.0,
 
 
-            # How far before the stop line should we begin braking?
-            "brake_start": 23.0,
+            # Planned stops use this fraction of the vehicle's deceleration
+            # limit; the braking distance follows from it and the jerk limit.
+            "decel_ratio": 0.5,
+            "decel_limit": rospy.get_param('/dbw_node/decel_limit', -5.),
+            "jerk_limit": rospy.get_param('~jerk_limit', 10.),
 
             # TODO:
             # When the car is at at least `overshoot` meters behind of 
@@ -90,15 +135,46 @@ class WaypointUpdater(object):
             # is no turning back. Negative value means this point is ahead of
             # the line
             # "overshoot": -5.7,
-
-            "brake_v": 0.0,
-            "brake_traj": (lambda i, wps: (i / float(len(wps))) * (self.config["v"]))
-            # "brake_traj": (lambda i, wps: 0.0)
         }
 
-        self.cnt = 0
-        
-        rospy.spin()
+        # Planning runs at a fixed rate from the latest pose and traffic
+        # light state, independent of how often those messages arrive.
+        self.plan_rate = rospy.get_param('~rate', 30.0)
+        self.loop_stats = LoopStats(self.plan_rate)
+
+        self.timing_reporter = TimingReporter(self.timings)
+        self.timing_reporter.add_source('planning_loop', self.loop_summary)
+        self.timing_reporter.add_source('wp_tracker', self.tracker_summary)
+
+        # Subscribe last: /base_waypoints is latched and its callback
+        # uses the configuration above.
+        rospy.Subscriber('/current_pose', PoseStamped, self.pose_cb)
+        rospy.Subscriber('/current_velocity', TwistStamped, self.velocity_cb)
+        rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
+        rospy.Subscriber('/traffic_waypoint', Int32, self.traffic_cb)
+        rospy.Subscriber('/vehicle/obstacle_points', PointCloud2, self.obstacle_cb)
+
+        self.loop()
+
+    def loop(self):
+        rate = rospy.Rate(self.plan_rate)
+        drive_timer = self.timings.timer('drive')
+        while not rospy.is_shutdown():
+            self.loop_stats.start(time.time())
+            with drive_timer:
+                self.drive()
+            self.loop_stats.stop(time.time())
+            rate.sleep()
+
+    def loop_summary(self):
+        summary = self.loop_stats.summary()
+        self.loop_stats.reset()
+        return summary
+
+    def tracker_summary(self):
+        if self.wp_tracker is None:
+            return None
+        return self.wp_tracker.stats()
 
     def pose_cb(self, msg):
         """
@@ -118,104 +194,176 @@ class WaypointUpdater(object):
             float64 z
             float64 w
         """
-        self.cnt += 1
-        if self.cnt % 10 != 0:
-          return
-
-        start_time = time.time()
-        
-        self.pose = msg.pose
-        pos = self.pose.position
-        quat = PyKDL.Rotation.Quaternion(self.pose.orientation.x,
-                                         self.pose.orientation.y,
-                                         self.pose.orientation.z,
-                                         self.pose.orientation.w)
-        orient = quat.GetRPY()
-        self.yaw = orient[2]
-
-        #self.drive()
-        elapsed_time = time.time() - start_time
-        rospy.loginfo('pose_cb time = %0.1fus\n' % (1000.0*1000*elapsed_time))
+        with self.timings.timer('pose_cb'):
+            self.pose = msg.pose
+            quat = PyKDL.Rotation.Quaternion(self.pose.orientation.x,
+                                             self.pose.orientation.y,
+                                             self.pose.orientation.z,
+                                             self.pose.orientation.w)
+            orient = quat.GetRPY()
+            self.yaw = orient[2]
+            self.poses_received += 1
+
+    def velocity_cb(self, msg):
+        self.cur_v = msg.twist.linear.x
 
     def waypoints_cb(self, waypoints):
-        start_time = time.time()
-        self.waypoints = waypoints.waypoints
-        self.waypoints_header = waypoints.header
-        elapsed_time = time.time() - start_time
-        rospy.loginfo('waypoints_cb time = %0.1fus\n' % (1000.0*1000*elapsed_time))
+        with self.timings.timer('waypoints_cb'):
+            self.waypoints = waypoints.waypoints
+            self.waypoints_header = waypoints.header
+            self.wp_index = WaypointIndex.from_waypoints(self.waypoints)
+            self.wp_tracker = WaypointTracker(self.wp_index)
+            self.brake_profiler = BrakeProfiler(
+                self.wp_index,
+                abs(self.tl_config["decel_limit"]) * self.tl_config["decel_ratio"],
+                self.tl_config["jerk_limit"])
+            self.target_v = np.empty(len(self.waypoints))
+            self.reset_target_speeds()
 
     def traffic_cb(self, msg):
-        start_time = time.time()
-        self.redlight_wp = None
-        tl_wp = msg.data
-        # `tl_wp >= self.cur_wp` ensures traffic light is in front of the car.
-        # rospy.loginfo("tl_wp: {}".format(tl_wp))
-        if tl_wp > -1 and tl_wp > self.cur_wp:
-            self.redlight_wp = tl_wp
-            rospy.loginfo("redlight_wp: {} cur_wp: {}".format(self.redlight_wp, self.cur_wp))
-        self.drive()
-        elapsed_time = time.time() - start_time
-        rospy.loginfo('traffic_cb time = %0.1fus\n' % (1000.0*1000*elapsed_time))
+        # Only the latest state is kept, the planning loop picks it up.
+        self.tl_wp = msg.data
 
     def obstacle_cb(self, msg):
-        # TODO: Callback for /obstacle_waypoint message. We will implement it later
-        pass
+        """ Find the first waypoint ahead of the car blocked by an obstacle
+        and publish it to /obstacle_waypoint.
+
+        All points of the cloud are mapped to the track in one batched query.
+
+        Args:
+            msg (PointCloud2): Obstacle points in the /world frame.
+        """
+        if self.wp_index is None or self.cur_wp is None:
+            return
+        cur_wp = self.cur_wp
+
+        points = cloud_to_array(msg)
+        self.obstacle_wp = -1
+        if len(points) > 0:
+            xy = np.column_stack((points['x'], points['y']))
+            idx, lateral = self.wp_index.project_batch(xy, max_dist=OBSTACLE_HALF_WIDTH)
+            blocked = idx[np.abs(lateral) < OBSTACLE_HALF_WIDTH]
+            if len(blocked) > 0:
+                ahead = self.wp_index.arc_distance(cur_wp, blocked)
+                # On a loop everything is ahead, only look half a lap forward.
+                ahead[(ahead < 0) | (ahead > self.wp_index.length / 2.0)] = np.inf
+                first = int(np.argmin(ahead))
+                if np.isfinite(ahead[first]):
+                    self.obstacle_wp = int(blocked[first])
+        self.obstacle_waypoint_pub.publish(Int32(self.obstacle_wp))
 
     def drive(self):
-        start_time = time.time()
-        if self.waypoints is not None:
+        pose = self.pose
+        if self.waypoints is not None and pose is not None:
             # rospy.loginfo("curyaw: {}".format(yaw))
+            self.loop_stats.inputs += self.poses_received
+            self.poses_received = 0
 
             # start = time.time()
-            self.cur_wp = self.get_closest_waypoint(self.pose)
+            pos = pose.position
+            self.cur_wp = self.wp_tracker.update(pos.x, pos.y)
             # end = time.time()
             # self.sum_wp_time += (end - start)
             # self.count_wp_time += 1
             # avg_wp_time = self.sum_wp_time / self.count_wp_time
             # rospy.loginfo("m_id time: {}".format(avg_wp_time))
 
-            lane = Lane()
-            first_wp_obj = self.waypoints[self.cur_wp]
+            self.redlight_wp = None
+            tl_wp = self.tl_wp
+            # `tl_wp > self.cur_wp` ensures traffic light is in front of the car.
+            if tl_wp > -1 and tl_wp > self.cur_wp:
+                self.redlight_wp = tl_wp
+                rospy.logdebug("redlight_wp: {} cur_wp: {}".format(self.redlight_wp, self.cur_wp))
 
             rl_is_visible = self.redlight_is_visible()
             redlight_wp = self.redlight_wp
 
-            rospy.loginfo("redlight_visible: {}, cur: {}, rl: {}({}m)".format(
-                rl_is_visible,
-                self.cur_wp,
-                redlight_wp,
-                None if redlight_wp is None else \
-                  (distance(self.waypoints[redlight_wp].pose.pose.position,
-                            self.waypoints[self.cur_wp].pose.pose.position))
-            ))
+            window = self.lookahead_wps()
+            plan_v = self.target_v[window]
 
             if rl_is_visible:
             # if False:
-                # stopline waypoint
+                # stopping waypoint
                 sl_wp = self.dist2wp(redlight_wp, -self.tl_config["offset"])
-                wps = self.wps_behind_wp(sl_wp, self.tl_config["brake_start"])
-                self.full_brake(wps)
-                rospy.loginfo("wps v: {}".format(
-                    list(map(lambda x: self.waypoints[x].twist.twist.linear.x, wps))))
-                if self.distance_to_wp(sl_wp) > self.tl_config["brake_start"]:
-                    self.set_waypoint_velocity(first_wp_obj, self.config["v"])
-
-            else:
-                self.set_waypoint_velocity(first_wp_obj, self.config["v"])
-
-            rospy.loginfo("v was set to: {}".format(
-                self.waypoints[self.cur_wp].twist.twist.linear.x))
-            
-            for i, wp in enumerate(self.waypoints[
-                self.cur_wp:(self.cur_wp+LOOKAHEAD_WPS)]):
-                lane.waypoints.append(wp)
+                wps, brake_v = self.full_brake(sl_wp)
+                self.overlay_brake(plan_v, window, wps, brake_v)
+
+            rospy.logdebug("v was set to: {}".format(plan_v[0]))
+
+            lane = self.fill_lane(window, plan_v)
 
             # rospy.loginfo("(p) next_wp angular: {}".format(lane.waypoints[0].twist.twist.angular))
             self.final_waypoints_pub.publish(lane)
-        elapsed_time = time.time() - start_time
-        rospy.loginfo('drive() time = %0.1fus\n' % (1000.0*1000*elapsed_time))
 
 
+    def reset_target_speeds(self):
+        """ Set the target speed of all base waypoints back to cruise speed.
+        """
+        self.target_v.fill(self.config["v"])
+
+    def lookahead_wps(self):
+        """ Get ids of the waypoints published ahead of the car.
+
+        The lookahead distance grows with the car's speed, so the number of
+        waypoints depends on both the speed and the waypoint spacing.
+
+        Returns:
+            ndarray (int): Waypoint ids starting at cur_wp.
+        """
+        dist = min(max(self.cur_v * LOOKAHEAD_TIME, LOOKAHEAD_MIN), LOOKAHEAD_MAX)
+        last_wp = self.wp_index.wp_at_distance(self.cur_wp, dist)
+        return self.wp_index.wps_between(self.cur_wp, last_wp)
+
+    def overlay_brake(self, plan_v, window, wps, brake_v):
+        """ Lower the planned speeds of the published waypoints to a braking profile.
+
+        Args:
+            plan_v (ndarray): Planned speed of each waypoint in `window`, updated in place.
+            window (ndarray): Ids of the published waypoints.
+            wps (ndarray): Ids of the braking waypoints, the last one is the stop line.
+            brake_v (ndarray): Speed at each of `wps`.
+        """
+        n = len(self.waypoints)
+        k = (window - wps[0]) % n
+        in_brake = k < len(wps)
+        plan_v[in_brake] = np.minimum(plan_v[in_brake], brake_v[k[in_brake]])
+
+        # Waypoints past the stop line keep the car stopped.
+        stop = np.nonzero(window == wps[-1])[0]
+        if len(stop) > 0:
+            plan_v[stop[0]:] = brake_v[-1]
+
+    def fill_lane(self, window, plan_v):
+        """ Fill the reused Lane message with the planned waypoints.
+
+        The published waypoints share their pose with the base waypoints,
+        which are left untouched; only their speed is set.
+
+        Args:
+            window (ndarray): Ids of the base waypoints to publish.
+            plan_v (ndarray): Planned speed of each of them.
+
+        Returns:
+            Lane: self.lane
+        """
+        count = len(window)
+        while len(self.lane_pool) < count:
+            self.lane_pool.append(Waypoint())
+
+        lane_wps = self.lane.waypoints
+        if len(lane_wps) > count:
+            del lane_wps[count:]
+        else:
+            lane_wps.extend(self.lane_pool[len(lane_wps):count])
+
+        for i in range(count):
+            base_wp = self.waypoints[window[i]]
+            wp = lane_wps[i]
+            wp.pose = base_wp.pose
+            wp.twist.twist.angular = base_wp.twist.twist.angular
+            wp.twist.twist.linear.x = float(plan_v[i])
+        return self.lane
+
     def get_waypoint_velocity(self, waypoint):
         return waypoint.twist.twist.linear.x
 
@@ -225,8 +373,8 @@ class WaypointUpdater(object):
     def wp_distance(self, wp1, wp2):
         """ Get distance between two waypoints.
 
-        The distance is calculated by adding distances sequentially for each
-        waypoint pair.
+        The distance is measured along the track, wrapping around the end
+        of the track if it is a loop.
 
         Args:
             wp1 (int): Index of the first waypoint (must be closest to the car)
@@ -235,77 +383,17 @@ class WaypointUpdater(object):
         Returns:
             double: Sum of distances of all waypoints between wp1 and wp2.
         """
-        # TODO: Circular path (i.e. wp1 can be > wp2)
-        dist = 0
-        for i in range(wp1, wp2+1):
-            dist += distance(self.waypoints[wp1].pose.pose.position, self.waypoints[i].pose.pose.position)
-            wp1 = i
-        return dist
+        return self.wp_index.arc_distance(wp1, wp2)
 
     def get_closest_waypoint(self, pose):
         """Identifies the closest path waypoint to the given position
-            https://en.wikipedia.org/wiki/Closest_pair_of_points_problem
+
         Args:
             pose (Pose): position to match a waypoint to
         Returns:
             int: index of the closest waypoint in self.waypoints
         """
-
-        pos = pose.position
-        l_id = 0
-        r_id = len(self.waypoints) - 1
-        m_id = len(self.waypoints)-1
-
-        while l_id < r_id:
-            ldist = distance(self.waypoints[l_id].pose.pose.position, pos)
-            rdist = distance(self.waypoints[r_id].pose.pose.position, pos)
-            xmid = (l_id + r_id) // 2
-            mdist = distance(self.waypoints[xmid].pose.pose.position, pos)
-
-            closest_dist = ldist
-            m_id = l_id
-            if mdist < closest_dist:
-                closest_dist = mdist
-                m_id = xmid
-            if rdist < closest_dist:
-                closest_dist = rdist
-                m_id = r_id
-
-            # If l_id is right before xmid and xmid is right before r_id,
-            # then xmid is the closest waypoint
-            if l_id == xmid -1 and xmid == r_id -1:
-                break
-
-            # c: car
-            # l: left point
-            # r: right point
-            # m: xmid
-            # *: closest waypoint
-            if rdist < mdist:
-                if ldist < rdist:
-                    # l--c----r--m
-                    r_id = xmid - 1
-                else:
-                    # l----c--r--m
-                    l_id = xmid + 1
-
-            elif mdist < closest_dist:
-                # l--c--m--*--r
-                l_id = xmid-1
-            elif mdist > closest_dist :
-                # l--c--*--m--r
-                r_id = xmid+1
-
-            elif mdist == closest_dist:
-                # ?-cm-?
-                if ldist < rdist:
-                    # l--cm---r
-                    r_id = xmid + (r_id - xmid) // 2
-                elif rdist < ldist:
-                    # l---cm--r
-                    l_id = xmid - (xmid - l_id) // 2
-
-        return m_id
+        return self.wp_index.closest_to_pose(pose)
 
     def get_waypoint_yaw(self, wp):
         """ Get yaw of a waypoint
@@ -344,14 +432,10 @@ class WaypointUpdater(object):
         Args:
             wp (int): Target waypoint.
         Returns:
-            double: Distance from current waypoint tp target waypoint
+            double: Distance from current waypoint tp target waypoint,
+                    negative if the target is behind the car.
         """
-        dist = 0.0
-        if self.cur_wp > wp:
-            dist = -self.wp_distance(wp, self.cur_wp)
-        else:
-            dist = self.wp_distance(self.cur_wp, wp)
-        return dist
+        return self.wp_index.signed_arc_distance(self.cur_wp, wp)
 
     def dist2wp(self, wp, dist):
         """ Find out last waypoint from given current waypoint and a distance.
@@ -364,19 +448,7 @@ class WaypointUpdater(object):
         Returns:
             int: The last waypoint's id.
         """
-        dist_tally = dist
-        d = 1
-        if dist < 0:
-            dist_tally *= -1
-            d = -1
-
-        fin_wp = wp
-        while dist_tally > 0:
-            new_fin_wp = fin_wp + d
-            dist = self.wp_distance(new_fin_wp, fin_wp)
-            dist_tally -= dist
-            fin_wp = new_fin_wp
-        return fin_wp
+        return self.wp_index.wp_at_distance(wp, dist)
 
     def wps_behind_wp(self, wp, dist):
         """ Get all waypoints under specific distance behind a waypoint.
@@ -391,30 +463,20 @@ class WaypointUpdater(object):
             list (int): List of waypoint ids.
         """
         start_wp = self.dist2wp(wp, -dist)
-        return range(start_wp, (wp + 1))
+        return self.wp_index.wps_between(start_wp, wp)
 
 
-    def full_brake(self, wps):
-        """ Initiate full brake through the given waypoint ids.
+    def full_brake(self, sl_wp):
+        """ Get a full brake profile that stops the car at the given waypoint.
 
         Args:
-            wps (list(int)): List of waypoint ids. The car should
-                             be at full stop at the last id.
+            sl_wp (int): Waypoint id where the car should be at full stop.
+
+        Returns:
+            (ndarray, ndarray): Braking waypoint ids, ending at sl_wp,
+                                and the speed at each of them.
         """
-        last_wp = wps[len(wps)-1]
-        self.set_waypoint_velocity(self.waypoints[last_wp], 0.)
-        waypoints = [self.waypoints[i] for i in wps][:-1]
-        waypoints.reverse()
-        for i, wp in enumerate(waypoints):
-            dist = distance(wp.pose.pose.position,
-                            self.waypoints[last_wp].pose.pose.position)
-            new_v = self.tl_config["brake_traj"](i, waypoints)
-            if new_v < 1.0: new_v = self.tl_config["brake_v"]
-            # rospy.loginfo("set v to {} (i = {})".format(new_v, i))
-            self.set_waypoint_velocity(
-                wp,
-                new_v
-                )
+        return self.brake_profiler.stop_profile(sl_wp, self.config["v"])
 
 if __name__ == '__main__':
     try: